@@ -0,0 +1,145 @@
+# 在其他程序中直接调用的提取接口：结果保存在内存中返回，不写任何文件
+# Library API: extract(root) returns the parsed categories in memory, with no global state and no files written.
+# Repeated calls in one process reuse a shared LRU cache, so unchanged xml and ma2 files are not parsed again.
+import asyncio
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+import parse
+from schema import Extractor, parse_fields, unknown_fields
+from xref import CrossIndex
+
+# 进程内缓存默认的内存上限
+DEFAULT_CACHE_BYTES = 128 * 1024 * 1024
+
+
+# 一个分类的提取结果：输出名（如Music）、各条目的字典、对应的xml文件，顺序与命令行输出相同
+class CategoryResult(NamedTuple):
+    name: str
+    entries: list
+    paths: list
+
+
+def dic_size(value):
+    # 估算提取结果占用的内存，作为缓存淘汰的依据
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(dic_size(key) + dic_size(item) for key, item in value.items())
+    elif isinstance(value, list):
+        size += sum(dic_size(item) for item in value)
+    return size
+
+
+def file_deps(deps):
+    # 条目依赖的各个文件的(路径, 大小, 修改时间)，任何一个变化都要重新解析；deps为parse.entry_deps的结果
+    return tuple((path, st.st_size, st.st_mtime_ns) for path, st in deps)
+
+
+class ParseCache:
+    # 进程内共用的LRU缓存：(xml路径, 提取配置) -> (依赖文件, 字典, 估算大小)
+    # 估算大小之和超过max_bytes时淘汰最久未使用的条目；可以在多个线程中同时使用
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, deps):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None or item[0] != deps:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, deps, dic):
+        size = dic_size(dic)
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            if size > self.max_bytes:
+                return
+            self.items[key] = (deps, dic, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self.items.popitem(last=False)
+                self.size -= evicted
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self.items)
+
+
+class CacheView:
+    # 一次提取使用的缓存接口，与Manifest一样提供get(entry, deps)与put(entry, dic, deps)，供Pipeline使用
+    def __init__(self, cache, config):
+        self.cache = cache
+        self.config = json.dumps(config, sort_keys=True)
+        self.hits = 0
+
+    def get(self, entry, deps):
+        dic = self.cache.get((entry.xml, self.config), file_deps(deps))
+        if dic is not None:
+            self.hits += 1
+        return dic
+
+    def put(self, entry, dic, deps):
+        self.cache.put((entry.xml, self.config), file_deps(deps), dic)
+
+
+# 进程内默认共用的缓存
+default_cache = ParseCache()
+
+
+async def extract_async(root, categories=None, workers=1, skip=parse.default_skip, fields=None, analyze=False,
+                        cache=default_cache):
+    # categories为需要的分类（目录名如music或输出名如Music），None表示全部
+    # fields与命令行的--fields相同，也可以直接传入parse_fields的结果；cache为None时不使用缓存
+    # 从缓存中取得的字典会在多次调用之间共用，调用方不应修改
+    selects = parse_fields(fields) if isinstance(fields, str) else fields or {}
+    unknown = unknown_fields({dir_name: table for dir_name, _, _, table in parse.categories}, selects)
+    if unknown:
+        raise ValueError(f'unknown fields: {", ".join(unknown)}')
+    if isinstance(categories, str):
+        categories = [categories]
+    index = parse.scan_opt(root, tuple(skip))
+    tasks = []
+    for dir_name, _, json_name, category_fields in parse.categories:
+        if dir_name not in index or categories is not None and not {dir_name, json_name} & set(categories):
+            continue
+        parser = Extractor(category_fields, selects.get(dir_name), {'analyze': analyze})
+        tasks.append((index[dir_name], json_name, parser))
+    view = CacheView(cache, {'analyze': analyze, 'fields': selects}) if cache is not None else None
+    pipeline = parse.Pipeline(None, workers if workers > 0 else os.cpu_count(), view, None)
+    await pipeline.run(tasks)
+    return {json_name: CategoryResult(json_name, pipeline.results[json_name], [entry.xml for entry in entries])
+            for entries, json_name, _ in tasks}
+
+
+def extract(root, categories=None, workers=1, skip=parse.default_skip, fields=None, analyze=False,
+            cache=default_cache):
+    # 同步版本，返回 输出名 -> CategoryResult；已经在事件循环中时请使用extract_async
+    return asyncio.run(extract_async(root, categories, workers, skip, fields, analyze, cache))
+
+
+def cross_index(results):
+    # 由extract的结果建立跨分类的ID索引、反向引用与悬空引用，get可以直接取出条目
+    id_keys = {json_name: fields[0].key for _, _, json_name, fields in parse.categories}
+    index = CrossIndex(keep=True)
+    for name, result in results.items():
+        for dic in result.entries:
+            index.add(name, dic.get(id_keys[name]), dic)
+    return index.resolve()
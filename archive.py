@@ -0,0 +1,235 @@
+# 直接读取zip或tar压缩包中的opt资源包，不解压到磁盘
+# Read OPT packages straight from zip or uncompressed tar archives. Members are addressed with virtual paths such as
+# 'A000.zip::A000/music/music011001/Music.xml'; open_file and file_stat accept these as well as normal paths.
+import errno
+import fnmatch
+import os
+import posixpath
+import tarfile
+import threading
+import time
+import zipfile
+from io import BytesIO
+from typing import NamedTuple
+
+# 压缩包路径与成员路径之间的分隔
+SEP = '::'
+EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+# 测试用：环境变量OPT_IO_LATENCY（秒）给每次列出目录、打开文件和stat加上固定的延迟，模拟网络存储
+# 设置在环境变量中，进程池的工作进程也会继承
+IO_LATENCY = float(os.environ.get('OPT_IO_LATENCY') or 0)
+# 预读的文件内容：路径 -> bytes，由prefetch在解析前放入，解析完成后移除
+preloaded = {}
+
+
+# 成员的大小与修改时间，用法与os.stat_result相同
+class MemberStat(NamedTuple):
+    st_size: int
+    st_mtime_ns: int
+
+
+def split_path(path):
+    # 'A000.zip::A000/Music.xml' -> ('A000.zip', 'A000/Music.xml')，普通路径返回(None, path)
+    archive_path, sep, member = path.partition(SEP)
+    if not sep:
+        return None, path
+    return archive_path, member.replace('\\', '/').strip('/')
+
+
+def is_archive(path):
+    return SEP in path or os.path.isfile(path) and path.lower().endswith(EXTENSIONS)
+
+
+class Archive:
+    # 打开压缩包时读取一次成员索引（zip的中央目录，tar的各个文件头），之后按成员名直接读取
+    def __init__(self, path):
+        self.path = path
+        st = os.stat(path)
+        self.signature = (st.st_size, st.st_mtime_ns)
+        self.lock = threading.Lock()
+        self.zip = self.tar = None
+        if zipfile.is_zipfile(path):
+            self.zip = zipfile.ZipFile(path)
+            infos = [info for info in self.zip.infolist() if not info.is_dir()]
+            self.members = {posixpath.normpath(info.filename).lstrip('/'): info for info in infos}
+        else:
+            try:
+                self.tar = tarfile.open(path, 'r:')
+            except tarfile.ReadError:
+                # 压缩过的tar只能从头顺序解压，无法按成员随机读取
+                raise ValueError(f'{path} is neither a zip nor an uncompressed tar archive '
+                                 f'(compressed tars cannot be read member by member, repack them as zip or tar)')
+            self.members = {posixpath.normpath(info.name).lstrip('/'): info
+                            for info in self.tar.getmembers() if info.isfile()}
+
+    def info(self, member):
+        info = self.members.get(member)
+        if info is None:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), f'{self.path}{SEP}{member}')
+        return info
+
+    def read(self, member):
+        info = self.info(member)
+        if self.zip is not None:
+            # ZipFile可以在多个线程中同时读取
+            return self.zip.read(info)
+        with self.lock:
+            return self.tar.extractfile(info).read()
+
+    def open(self, member):
+        # 按块读取的文件对象，大的成员不会整个读入内存
+        info = self.info(member)
+        if self.zip is not None:
+            return self.zip.open(info)
+        with self.lock:
+            return LockedMember(self.tar.extractfile(info), self.lock)
+
+    def stat(self, member):
+        info = self.info(member)
+        if self.zip is not None:
+            return MemberStat(info.file_size, int(time.mktime(info.date_time + (0, 0, -1))) * 1000000000)
+        return MemberStat(info.size, int(info.mtime) * 1000000000)
+
+
+class LockedMember:
+    # tar的成员共用压缩包的文件句柄，每次读取都在锁内完成，多个线程可以交替按块读取
+    def __init__(self, f, lock):
+        self.f = f
+        self.lock = lock
+
+    def read(self, size=-1):
+        with self.lock:
+            return self.f.read(size)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+archives = {}
+archives_lock = threading.Lock()
+
+
+def get_archive(path):
+    # 每个进程各自打开一次压缩包：fork出的工作进程不能与父进程共用同一个文件句柄
+    # 压缩包本身被替换后重新读取索引
+    key = (os.getpid(), os.path.abspath(path))
+    st = os.stat(path)
+    with archives_lock:
+        archive = archives.get(key)
+        if archive is None or archive.signature != (st.st_size, st.st_mtime_ns):
+            archive = archives[key] = Archive(path)
+    return archive
+
+
+def io_wait():
+    if IO_LATENCY:
+        time.sleep(IO_LATENCY)
+
+
+def open_file(path):
+    # 以二进制方式打开普通文件或压缩包成员，成员不存在时与普通文件一样抛出FileNotFoundError
+    # 已经预读的文件直接从内存读取
+    data = preloaded.get(path)
+    if data is not None:
+        return BytesIO(data)
+    io_wait()
+    archive_path, member = split_path(path)
+    if archive_path is None:
+        return open(path, 'rb')
+    return BytesIO(get_archive(archive_path).read(member))
+
+
+def open_stream(path):
+    # 与open_file相同，但压缩包成员按块读取而不是整个读入内存，用于哈希视频等大文件
+    io_wait()
+    archive_path, member = split_path(path)
+    if archive_path is None:
+        return open(path, 'rb')
+    return get_archive(archive_path).open(member)
+
+
+def file_stat(path):
+    io_wait()
+    archive_path, member = split_path(path)
+    if archive_path is None:
+        return os.stat(path)
+    return get_archive(archive_path).stat(member)
+
+
+def resolve_root(path, dir_names):
+    # 压缩包内opt目录的位置：可以用 压缩包::目录 指定；没有指定时分类目录直接在最上层，
+    # 或者最上层只有一个目录（如A000/）时自动进入
+    archive_path, inner = split_path(path)
+    if archive_path is None:
+        archive_path, inner = path, ''
+    if not inner:
+        tops = {member.split('/', 1)[0] for member in get_archive(archive_path).members if '/' in member}
+        if not tops & set(dir_names) and len(tops) == 1:
+            inner = tops.pop()
+    return archive_path, inner
+
+
+def archive_opt_name(path, dir_names):
+    # 压缩包内的opt目录名，分类目录直接在最上层时使用压缩包的文件名
+    archive_path, inner = resolve_root(path, dir_names)
+    name = os.path.basename(archive_path)
+    for ext in EXTENSIONS:
+        if name.lower().endswith(ext):
+            name = name[:-len(ext)]
+            break
+    return inner.rpartition('/')[2] or name
+
+
+def relative_path(path, root, dir_names):
+    # 条目相对于opt目录的路径，用于比较两个版本中的同一个条目
+    archive_path, inner = resolve_root(root, dir_names) if is_archive(root) else (None, root)
+    if archive_path is None:
+        return os.path.relpath(path, root)
+    return split_path(path)[1][len(inner):].lstrip('/')
+
+
+def scan_members(archive_path, archive, tree, path, file_name, skip, entries):
+    # 与scan_category相同的规则：跳过匹配的名称，子目录按名称排序
+    dirs, files = tree[path]
+    names = [name for name in files if not any(fnmatch.fnmatchcase(name, pattern) for pattern in skip)]
+    if file_name in names:
+        member = f'{path}/{file_name}'
+        entries.append((f'{archive_path}{SEP}{path}', f'{archive_path}{SEP}{member}', archive.stat(member),
+                        tuple(sorted(name for name in names if name != file_name))))
+    for name in sorted(dirs):
+        if not any(fnmatch.fnmatchcase(name, pattern) for pattern in skip):
+            scan_members(archive_path, archive, tree, f'{path}/{name}', file_name, skip, entries)
+
+
+def scan_archive(path, file_names, skip):
+    # 由成员索引建立 分类目录名 -> [(条目目录, xml路径, stat, 其余文件名)]，与scan_opt的结果对应
+    archive_path, inner = resolve_root(path, file_names)
+    archive = get_archive(archive_path)
+    prefix = f'{inner}/' if inner else ''
+    # 目录 -> (子目录名集合, 文件名列表)，目录为压缩包内的完整路径
+    tree = {}
+    for member in archive.members:
+        if not member.startswith(prefix):
+            continue
+        parent, _, name = member.rpartition('/')
+        tree.setdefault(parent, (set(), []))[1].append(name)
+        while len(parent) > len(inner):
+            grand, _, dir_name = parent.rpartition('/')
+            dirs = tree.setdefault(grand, (set(), []))[0]
+            if dir_name in dirs:
+                break
+            dirs.add(dir_name)
+            parent = grand
+    index = {}
+    for dir_name in sorted(tree.get(inner, (set(), []))[0]):
+        if dir_name in file_names:
+            entries = []
+            scan_members(archive_path, archive, tree, prefix + dir_name, file_names[dir_name], skip, entries)
+            index[dir_name] = entries
+    return index
@@ -0,0 +1,199 @@
+# 资源清单：音频、封面、视频等非xml文件的内容哈希，并关联到解析得到的乐曲、角色、头像框、头像ID
+# Asset manifest: content hashes of the sound, jacket, movie and other image files of an OPT tree, linked to the
+# IDs the parsers extract. Files whose size and mtime match the previous manifest keep their old hash.
+import fnmatch
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from archive import SEP, file_stat, get_archive, is_archive, open_stream, relative_path, resolve_root
+
+MANIFEST_VERSION = 1
+# opt根目录下的资源目录（包括子目录）及其关联的分类；文件名中最后一段数字为ID
+ASSET_DIRS = [
+    ('SoundData', 'Music'),
+    ('MovieData', 'Music'),
+    ('AssetBundleImages/jacket', 'Music'),
+    ('AssetBundleImages/jacket_s', 'Music'),
+    ('AssetBundleImages/chara', 'Chara'),
+    ('AssetBundleImages/frame', 'Frame'),
+    ('AssetBundleImages/icon', 'Icon'),
+]
+# 各分类条目目录中的谱面以外的文件同样作为资源，ID取自目录名（如music011001）
+ENTRY_SKIP = ('.xml', '.ma2')
+# 每次读取的大小，视频文件（包括压缩包中的）不会整个读入内存
+BLOCK_SIZE = 1024 * 1024
+NUMBER = re.compile(r'\d+')
+
+
+def asset_number(name):
+    numbers = NUMBER.findall(os.path.splitext(name)[0])
+    return int(numbers[-1]) if numbers else None
+
+
+def walk_dir(path, rel, skip, files):
+    try:
+        it = os.scandir(path)
+    except FileNotFoundError:
+        return
+    with it:
+        items = sorted(it, key=lambda item: item.name)
+    for item in items:
+        if any(fnmatch.fnmatchcase(item.name, pattern) for pattern in skip):
+            continue
+        if item.is_dir(follow_symlinks=False):
+            walk_dir(item.path, f'{rel}/{item.name}', skip, files)
+        else:
+            files.append((f'{rel}/{item.name}', item.path, item.stat()))
+
+
+def list_assets(root, dir_names, skip):
+    # 资源目录中的文件：[(相对于opt根目录的路径, 路径, stat, 分类)]
+    assets = []
+    if is_archive(root):
+        archive_path, inner = resolve_root(root, dir_names)
+        archive = get_archive(archive_path)
+        prefix = f'{inner}/' if inner else ''
+        # 成员只排序、遍历一次，按所在的资源目录分组，结果的顺序与目录中的相同
+        dirs = [(f'{prefix}{asset_dir}/', category, []) for asset_dir, category in ASSET_DIRS]
+        starts = tuple(start for start, _, _ in dirs)
+        for member in sorted(archive.members):
+            if not member.startswith(starts) or any(
+                    fnmatch.fnmatchcase(part, pattern) for part in member.split('/') for pattern in skip):
+                continue
+            for start, category, found in dirs:
+                if member.startswith(start):
+                    found.append((member[len(prefix):], f'{archive_path}{SEP}{member}', archive.stat(member),
+                                  category))
+                    break
+        return [asset for _, _, found in dirs for asset in found]
+    for asset_dir, category in ASSET_DIRS:
+        files = []
+        walk_dir(os.path.join(root, *asset_dir.split('/')), asset_dir, skip, files)
+        assets += [(rel, path, st, category) for rel, path, st in files]
+    return assets
+
+
+def entry_assets(root, index, dir_categories):
+    # 由扫描opt时建立的索引取出条目目录中的其他文件，不再遍历一次
+    assets = []
+    for dir_name, entries in index.items():
+        category = dir_categories[dir_name]
+        for entry in entries:
+            for name in entry.files:
+                if name.lower().endswith(ENTRY_SKIP):
+                    continue
+                path = os.path.join(entry.path, name)
+                rel = relative_path(path, root, list(dir_categories)).replace(os.sep, '/')
+                assets.append((rel, path, file_stat(path), category, asset_number(os.path.basename(entry.path))))
+    return assets
+
+
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open_stream(path) as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_chunk(paths):
+    return [hash_file(path) for path in paths]
+
+
+def split_by_size(items, workers):
+    # 按文件大小把需要哈希的文件分成大约workers*4块，大文件较多的块不会拖慢整体
+    total = sum(size for _, size in items)
+    target = max(1, total // (workers * 4))
+    chunks = []
+    chunk = []
+    size = 0
+    for path, item_size in items:
+        chunk.append(path)
+        size += item_size
+        if size >= target:
+            chunks.append(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+class IdLinker:
+    # 资源文件名中的数字 -> 分类中实际存在的ID；乐曲的标准与DX谱面共用资源，按ID的后四位对应
+    def __init__(self, ids):
+        self.ids = ids
+        self.music = {}
+        for music_id in ids.get('Music', ()):
+            self.music.setdefault(music_id % 10000, []).append(music_id)
+
+    def link(self, category, number):
+        if number is None:
+            return []
+        if number in self.ids.get(category, ()):
+            return [number]
+        if category == 'Music':
+            return list(self.music.get(number % 10000, ()))
+        return []
+
+
+def load_manifest(path):
+    # 上一次的清单，不存在或版本不同时返回空的清单
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if data.get('version') != MANIFEST_VERSION:
+        return {}
+    return data.get('assets', {})
+
+
+def build_manifest(roots, indexes, dir_categories, ids, previous=None, workers=1, skip=()):
+    # roots与indexes一一对应（合并多个opt时按层顺序），相同路径的资源由后面的opt覆盖
+    # ids为 分类输出名 -> ID集合；返回 相对路径 -> 资源记录，以及这次重新哈希的文件数
+    previous = previous or {}
+    found = {}
+    for root, index in zip(roots, indexes):
+        for rel, path, st, category in list_assets(root, list(dir_categories), skip):
+            found[rel] = (path, st, category, asset_number(os.path.basename(rel)))
+        for rel, path, st, category, number in entry_assets(root, index, dir_categories):
+            found[rel] = (path, st, category, number)
+    linker = IdLinker(ids)
+    assets = {}
+    todo = []
+    for rel, (path, st, category, number) in found.items():
+        old = previous.get(rel)
+        record = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha1': None, 'category': category,
+                  'ids': linker.link(category, number)}
+        if old is not None and old['size'] == st.st_size and old['mtime'] == st.st_mtime_ns:
+            record['sha1'] = old['sha1']
+        else:
+            todo.append((rel, path, st.st_size))
+        assets[rel] = record
+    # 文件读取与哈希在线程池中并行，hashlib计算时释放GIL
+    paths = {path: rel for rel, path, _ in todo}
+    chunks = split_by_size([(path, size) for _, path, size in todo], workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk, digests in zip(chunks, executor.map(hash_chunk, chunks)):
+            for path, digest in zip(chunk, digests):
+                assets[paths[path]]['sha1'] = digest
+    return assets, len(todo)
+
+
+def manifest_changes(previous, assets):
+    # 与上一次的清单相比新增、内容变化与删除的资源
+    added = [rel for rel in assets if rel not in previous]
+    changed = [rel for rel in assets if rel in previous and previous[rel]['sha1'] != assets[rel]['sha1']]
+    removed = [rel for rel in previous if rel not in assets]
+    return added, changed, removed
+
+
+def save_manifest(path, assets, added, changed, removed):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'version': MANIFEST_VERSION, 'added': added, 'changed': changed, 'removed': removed,
+                            'assets': assets}, indent=4, ensure_ascii=False))
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,169 @@
+# 性能测试：在不同规模的合成opt资源包上测试各分类的解析以及完整流程
+# Benchmark suite: per-category extractor throughput and end-to-end pipeline runs on synthetic OPT trees.
+import argparse
+import json
+import os.path
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import parse
+import synth_opt
+from schema import Extractor
+
+PARSE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parse.py')
+# 每次在一个新的子进程中启动parse.py并等待结束
+# RUSAGE_CHILDREN的ru_maxrss只是其中最大的一个进程的峰值，不是整个进程池的；进程池的峰值在Linux上
+# 每隔SAMPLE秒从/proc读取parse.py及其所有工作进程的RSS之和，取最大值
+PIPELINE_CHILD = '''
+import json, subprocess, sys, time
+SAMPLE = 0.02
+
+
+def tree_rss(pid):
+    total = 0
+    pids = [pid]
+    while pids:
+        pid = pids.pop()
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                total += sum(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+            with open(f'/proc/{pid}/task/{pid}/children') as f:
+                pids += [int(child) for child in f.read().split()]
+        except (OSError, ValueError):
+            pass
+    return total
+
+
+start = time.perf_counter()
+process = subprocess.Popen([sys.executable] + sys.argv[1:], stdout=subprocess.DEVNULL)
+rss = None
+while process.poll() is None:
+    if sys.platform.startswith('linux'):
+        rss = max(rss or 0, tree_rss(process.pid))
+    time.sleep(SAMPLE)
+seconds = time.perf_counter() - start
+if process.returncode:
+    raise subprocess.CalledProcessError(process.returncode, process.args)
+try:
+    import resource
+    scale = 1 if sys.platform == 'darwin' else 1024
+    process_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+except ImportError:
+    process_rss = None
+print(json.dumps({'seconds': seconds, 'rss': rss, 'processRss': process_rss}))
+'''
+
+
+def mib(size):
+    return 'n/a' if size is None else f'{size / 1024 / 1024:.1f}'
+
+
+def bench_categories(root, analyze, repeat):
+    # 在当前进程中逐个分类调用提取函数，tracemalloc记录解析过程中的峰值内存
+    index = parse.scan_opt(root)
+    results = []
+    for dir_name, _, json_name, fields in parse.categories:
+        entries = index.get(dir_name)
+        if not entries:
+            continue
+        parser = Extractor(fields, None, {'analyze': analyze})
+        size = sum(entry.stat.st_size for entry in entries)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for entry in entries:
+                parser(entry.xml)
+            spent = time.perf_counter() - start
+            best = spent if best is None else min(best, spent)
+        tracemalloc.start()
+        for entry in entries:
+            parser(entry.xml)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append({'category': json_name, 'files': len(entries), 'bytes': size, 'seconds': best,
+                        'filesPerSec': len(entries) / best if best else 0.0, 'peakTraced': peak})
+    return results
+
+
+def bench_pipeline(root, jobs, output_format, analyze, io_concurrency=1, latency=0.0):
+    # 完整运行一次parse.py，输出写到临时目录；latency通过OPT_IO_LATENCY给每次文件访问加上延迟
+    with tempfile.TemporaryDirectory() as out:
+        command = [sys.executable, '-c', PIPELINE_CHILD, PARSE_SCRIPT, root, '-j', str(jobs),
+                   '--format', output_format, '--io-concurrency', str(io_concurrency)]
+        if analyze:
+            command.append('--analyze')
+        env = dict(os.environ, OPT_IO_LATENCY=str(latency))
+        result = subprocess.run(command, cwd=out, env=env, capture_output=True, text=True, check=True)
+        output = sum(os.path.getsize(os.path.join(out, name)) for name in os.listdir(out))
+    report = json.loads(result.stdout.splitlines()[-1])
+    report.update(jobs=jobs, format=output_format, ioConcurrency=io_concurrency, latency=latency,
+                  outputBytes=output)
+    return report
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Benchmark the category extractors and the full pipeline '
+                                                     'on synthetic OPT trees.')
+    arg_parser.add_argument('--sizes', default='10,100,1000',
+                            help='comma separated entries per category, 10 to 100000 (default: 10,100,1000)')
+    arg_parser.add_argument('--notes', type=int, default=500, help='maximum notes per chart (default: 500)')
+    arg_parser.add_argument('-j', '--jobs', default='1',
+                            help='comma separated worker counts for the pipeline runs, 0 = cpu count (default: 1)')
+    arg_parser.add_argument('--format', default='json', choices=['json', 'ndjson', 'sqlite'],
+                            help='pipeline output format (default: json)')
+    arg_parser.add_argument('--analyze', action='store_true', help='include the chart analytics')
+    arg_parser.add_argument('--io-concurrency', default='1',
+                            help='comma separated read-ahead thread counts for the pipeline runs (default: 1)')
+    arg_parser.add_argument('--latency', type=float, default=0.0, metavar='SECONDS',
+                            help='artificial latency added to every directory listing, open and stat of the '
+                                 'pipeline runs, to simulate network storage (default: 0)')
+    arg_parser.add_argument('-r', '--repeat', type=int, default=3, help='best of N extractor runs (default: 3)')
+    arg_parser.add_argument('--dir', help='keep the generated trees here and reuse them on later runs')
+    arg_parser.add_argument('--json', metavar='FILE', help='also write the results to a JSON file')
+    args = arg_parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    jobs_list = [int(jobs) or os.cpu_count() for jobs in args.jobs.split(',')]
+    io_list = [max(1, int(count)) for count in args.io_concurrency.split(',')]
+    tmp = None
+    base = args.dir
+    if base is None:
+        tmp = tempfile.TemporaryDirectory()
+        base = tmp.name
+    results = []
+    try:
+        for size in sizes:
+            # parse.py以opt文件夹的上一级目录名作为输出文件名前缀
+            root = os.path.join(base, f'n{size}', 'A000') + os.sep
+            if not os.path.isdir(root):
+                start = time.perf_counter()
+                files = synth_opt.generate(root, size, notes=args.notes)
+                print(f'Generated {files} xml files for n={size} in {time.perf_counter() - start:.1f} s')
+            print(f'\nn={size}')
+            print(f'{"category":<16}{"files":>8}{"MiB":>8}{"seconds":>10}{"files/s":>10}{"peak MiB":>10}')
+            categories = bench_categories(root, args.analyze, args.repeat)
+            for row in categories:
+                print(f'{row["category"]:<16}{row["files"]:>8}{mib(row["bytes"]):>8}{row["seconds"]:>10.3f}'
+                      f'{row["filesPerSec"]:>10.0f}{mib(row["peakTraced"]):>10}')
+            pipelines = []
+            for jobs in jobs_list:
+                for io_concurrency in io_list:
+                    run = bench_pipeline(root, jobs, args.format, args.analyze, io_concurrency, args.latency)
+                    files = sum(row['files'] for row in categories)
+                    run['filesPerSec'] = files / run['seconds'] if run['seconds'] else 0.0
+                    pipelines.append(run)
+                    print(f'pipeline -j {jobs} --io-concurrency {io_concurrency} {args.format}: '
+                          f'{run["seconds"]:.3f} s, {run["filesPerSec"]:.0f} files/s, '
+                          f'peak RSS {mib(run["rss"])} MiB (largest process {mib(run["processRss"])} MiB), '
+                          f'output {mib(run["outputBytes"])} MiB')
+            results.append({'size': size, 'categories': categories, 'pipeline': pipelines})
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(results, indent=4, ensure_ascii=False))
@@ -0,0 +1,73 @@
+# 紧凑输出的读取性能：逐个json.load每个分类的json文件 vs compact.load读取紧凑输出
+# Benchmark of the compact output: file sizes and load time of compact.load against json.load of the json files.
+import argparse
+import glob
+import json
+import os.path
+import subprocess
+import sys
+import tempfile
+import time
+
+import compact
+import synth_opt
+
+PARSE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parse.py')
+
+
+def load_json(out, opt_name):
+    # 与compact.load的结果相同：分类输出名 -> 条目列表
+    categories = {}
+    for path in sorted(glob.glob(os.path.join(out, f'{opt_name}-*.json'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            categories[os.path.basename(path)[len(opt_name) + 1:-len('.json')]] = json.load(f)
+    return categories
+
+
+def timeit(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        spent = time.perf_counter() - start
+        best = spent if best is None else min(best, spent)
+    return best
+
+
+def mib(size):
+    return f'{size / 1024 / 1024:.2f}'
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Compare the size and load time of the compact output with '
+                                                     'the json output.')
+    arg_parser.add_argument('path', nargs='?', help='an OPT folder (default: a synthetic tree)')
+    arg_parser.add_argument('-n', '--entries', type=int, default=1500,
+                            help='entries per category of the synthetic tree (default: 1500)')
+    arg_parser.add_argument('--notes', type=int, default=50, help='maximum notes per synthetic chart (default: 50)')
+    arg_parser.add_argument('-r', '--repeat', type=int, default=5, help='best of N loads (default: 5)')
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = args.path
+        if root is None:
+            root = os.path.join(tmp, 'A000')
+            synth_opt.generate(root, args.entries, notes=args.notes)
+        out = os.path.join(tmp, 'out')
+        os.mkdir(out)
+        # parse.py以opt目录名作为输出文件名前缀
+        opt_name = os.path.basename(os.path.normpath(root))
+        for output_format in ('json', 'compact', 'compact-bin'):
+            subprocess.run([sys.executable, PARSE_SCRIPT, os.path.join(root, ''), '-j', '0', '--format', output_format],
+                           cwd=out, stdout=subprocess.DEVNULL, check=True)
+        expected = load_json(out, opt_name)
+        json_size = sum(os.path.getsize(path) for path in glob.glob(os.path.join(out, f'{opt_name}-*.json')))
+        print(f'{sum(len(dics) for dics in expected.values())} entries')
+        print(f'{"output":<24}{"MiB":>8}{"load s":>10}')
+        print(f'{"json (per category)":<24}{mib(json_size):>8}{timeit(lambda: load_json(out, opt_name), args.repeat):>10.3f}')
+        for output_format, extension in compact.EXTENSIONS.items():
+            path = os.path.join(out, f'{opt_name}.{extension}')
+            # 先确认读回的内容与json输出相同
+            assert compact.load(path) == expected, output_format
+            print(f'{output_format:<24}{mib(os.path.getsize(path)):>8}'
+                  f'{timeit(lambda: compact.load(path), args.repeat):>10.3f}')
@@ -0,0 +1,67 @@
+# ma2统计读取的性能对比：原来的整文件正则扫描 vs 从文件末尾读取统计段
+# Benchmark of ma2_reader: the old whole-file regex scan vs the tail reader in ma2.py.
+import argparse
+import glob
+import os.path
+import random
+import re
+import tempfile
+import time
+
+import parse
+from synth_opt import write_chart
+
+
+def ma2_reader_regex(ma2_file):
+    # 原来的实现，作为对照
+    if os.path.exists(ma2_file):
+        with open(ma2_file, 'r') as f:
+            ma2 = f.read()
+        num_tap = int(next(iter(re.findall(r"T_NUM_TAP\s(\d+)", ma2)), '0'))
+        num_break = int(next(iter(re.findall(r"T_NUM_BRK\s(\d+)", ma2)), '0'))
+        num_hold = int(next(iter(re.findall(r"T_NUM_HLD\s(\d+)", ma2)), '0'))
+        num_slide = int(next(iter(re.findall(r"T_NUM_SLD\s(\d+)", ma2)), '0'))
+        num_all = int(next(iter(re.findall(r"T_NUM_ALL\s(\d+)", ma2)), '0'))
+        return num_tap, num_break, num_hold, num_slide, num_all
+
+
+def timeit(func, files, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for file in files:
+            func(file)
+        spent = time.perf_counter() - start
+        best = spent if best is None else min(best, spent)
+    return best
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Benchmark ma2_reader against the old regex implementation.')
+    arg_parser.add_argument('path', nargs='?', help='an OPT folder or any folder with .ma2 files (default: synthetic charts)')
+    arg_parser.add_argument('-n', '--count', type=int, default=500, help='number of synthetic charts (default: 500)')
+    arg_parser.add_argument('--notes', type=int, default=1000, help='notes per synthetic chart (default: 1000)')
+    arg_parser.add_argument('-r', '--repeat', type=int, default=5, help='best of N runs (default: 5)')
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.path:
+            files = sorted(glob.glob(os.path.join(args.path, '**', '*.ma2'), recursive=True))
+        else:
+            random.seed(0)
+            files = [os.path.join(tmp, f'{i:06d}.ma2') for i in range(args.count)]
+            for file in files:
+                write_chart(file, args.notes)
+        if not files:
+            raise SystemExit('No .ma2 files found.')
+
+        # 先确认两种实现的结果一致
+        for file in files:
+            assert parse.ma2_reader(file) == ma2_reader_regex(file), file
+
+        old = timeit(ma2_reader_regex, files, args.repeat)
+        new = timeit(parse.ma2_reader, files, args.repeat)
+        print(f'{len(files)} charts, {sum(os.path.getsize(f) for f in files) / 1024 / 1024:.1f} MiB')
+        print(f'regex reader: {old:.3f} s ({old / len(files) * 1e6:.0f} us/chart)')
+        print(f'tail reader:  {new:.3f} s ({new / len(files) * 1e6:.0f} us/chart)')
+        print(f'speedup: {old / new:.1f}x')
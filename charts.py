@@ -0,0 +1,223 @@
+# 谱面统计的列式数据：每张谱面一行，各列连续存放在一个二进制文件中，可以直接mmap或用NumPy读取
+# Columnar chart statistics: one row per chart of Music, every column stored as one contiguous little-endian block.
+# load() maps the file and exposes the columns as NumPy arrays (or memoryviews without NumPy), so the summary
+# queries below run over whole columns instead of re-parsing Music.json.
+#
+# Layout: MAGIC, then struct HEADER (version, rows, columns), then per column: name length (B), name, type code
+# (c), offset (Q). Each column block starts at its offset, aligned to 8 bytes.
+import argparse
+import heapq
+import math
+import mmap
+import struct
+import sys
+import time
+from array import array
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CHARTS_VERSION = 1
+MAGIC = b'OPTCHART'
+HEADER = struct.Struct('<IQI')
+# 列名与array的类型码：b为int8，i为int32，d为float64；缺失的整数为-1，缺失的小数为NaN
+COLUMNS = (
+    ('musicId', 'i'),
+    ('difficulty', 'b'),
+    ('level', 'd'),
+    ('designerId', 'i'),
+    ('bpm', 'd'),
+    ('tap', 'i'),
+    ('break', 'i'),
+    ('hold', 'i'),
+    ('slide', 'i'),
+    ('all', 'i'),
+    # 以下两列只在--analyze时有值
+    ('length', 'd'),
+    ('avgDensity', 'd'),
+)
+VOLUME_KEYS = ('tap', 'break', 'hold', 'slide', 'all')
+# 谱面表用到的Music字段，--fields没有选择时也会提取；difficulty只在--charts时提取，不出现在输出中
+CHART_FIELDS = ('musicId', 'bpm', 'note.level', 'note.designerId', 'note.volume', 'note.chart', 'note.difficulty')
+
+
+def missing(typecode):
+    return math.nan if typecode == 'd' else -1
+
+
+def value_or(value, typecode):
+    return missing(typecode) if value is None else value
+
+
+class ChartTable:
+    # 逐个加入Music的条目，难度为谱面在xml中<Notes>的原始位置（等级为0的谱面被去掉之前）
+    def __init__(self):
+        self.columns = {name: array(typecode) for name, typecode in COLUMNS}
+
+    def add(self, dic):
+        columns = self.columns
+        for note in dic.get('note') or ():
+            volume = note.get('volume') or {}
+            chart = note.get('chart') or {}
+            columns['musicId'].append(value_or(dic.get('musicId'), 'i'))
+            columns['difficulty'].append(value_or(note.get('difficulty'), 'b'))
+            columns['level'].append(value_or(note.get('level'), 'd'))
+            columns['designerId'].append(value_or(note.get('designerId'), 'i'))
+            columns['bpm'].append(value_or(dic.get('bpm'), 'd'))
+            for key in VOLUME_KEYS:
+                columns[key].append(value_or(volume.get(key), 'i'))
+            columns['length'].append(value_or(chart.get('length'), 'd'))
+            columns['avgDensity'].append(value_or(chart.get('avgDensity'), 'd'))
+
+    async def tap(self, dics):
+        # 接在Music的输出之前，条目经过时加入；去掉只为谱面表提取的difficulty，输出与没有--charts时相同
+        async for dic in dics:
+            self.add(dic)
+            if dic.get('note'):
+                dic = dict(dic, note=[{key: value for key, value in note.items() if key != 'difficulty'}
+                                      for note in dic['note']])
+            yield dic
+
+    def __len__(self):
+        return len(self.columns['musicId'])
+
+    def save(self, path):
+        header = MAGIC + HEADER.pack(CHARTS_VERSION, len(self), len(COLUMNS))
+        descriptors_size = sum(1 + len(name.encode()) + 1 + 8 for name, _ in COLUMNS)
+        offset = align(len(header) + descriptors_size)
+        descriptors = b''
+        blocks = []
+        for name, typecode in COLUMNS:
+            data = self.columns[name]
+            if sys.byteorder == 'big':
+                data = array(typecode, data)
+                data.byteswap()
+            encoded = name.encode()
+            descriptors += struct.pack('<B', len(encoded)) + encoded + struct.pack('<cQ', typecode.encode(), offset)
+            blocks.append((offset, data.tobytes()))
+            offset = align(offset + len(blocks[-1][1]))
+        with open(path, 'wb') as f:
+            f.write(header + descriptors)
+            for start, data in blocks:
+                f.write(b'\0' * (start - f.tell()))
+                f.write(data)
+
+
+def align(offset):
+    return (offset + 7) & ~7
+
+
+class ChartData:
+    # 只读的列式数据；columns为 列名 -> NumPy数组（没有NumPy时为memoryview），数据直接映射自文件
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self.map)
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'{path} is not a chart statistics file')
+        version, self.rows, count = HEADER.unpack_from(buffer, len(MAGIC))
+        if version != CHARTS_VERSION:
+            raise ValueError(f'{path} was written by a different version of the chart statistics')
+        position = len(MAGIC) + HEADER.size
+        self.columns = {}
+        for _ in range(count):
+            size = buffer[position]
+            name = bytes(buffer[position + 1:position + 1 + size]).decode()
+            typecode, offset = struct.unpack_from('<cQ', buffer, position + 1 + size)
+            position += 1 + size + 9
+            typecode = typecode.decode()
+            block = buffer[offset:offset + self.rows * array(typecode).itemsize]
+            if numpy is not None:
+                self.columns[name] = numpy.frombuffer(block, dtype=numpy.dtype(typecode).newbyteorder('<'))
+            elif sys.byteorder == 'little':
+                self.columns[name] = block.cast(typecode)
+            else:
+                column = array(typecode, block.tobytes())
+                column.byteswap()
+                self.columns[name] = column
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        return self.rows
+
+    def level_histogram(self, step=0.1):
+        # 各等级（按step向下取整，如13.7在step为1时计入13）的谱面数，按等级排列
+        level = self.columns['level']
+        if numpy is not None:
+            level = level[~numpy.isnan(level)]
+            values, counts = numpy.unique(numpy.floor(numpy.round(level / step, 6)), return_counts=True)
+            return [(round(float(value) * step, 3), int(count)) for value, count in zip(values, counts)]
+        counts = Counter(math.floor(round(value / step, 6)) for value in level if not math.isnan(value))
+        return [(round(value * step, 3), counts[value]) for value in sorted(counts)]
+
+    def designer_totals(self, column='all'):
+        # 各谱师（designerId）的谱面数与某一列之和，按总数从大到小排列
+        designers, values = self.columns['designerId'], self.columns[column]
+        if numpy is not None:
+            ids, inverse = numpy.unique(designers, return_inverse=True)
+            totals = numpy.bincount(inverse, weights=numpy.maximum(values, 0))
+            charts = numpy.bincount(inverse)
+            order = numpy.argsort(-totals, kind='stable')
+            return [(int(ids[i]), int(charts[i]), int(totals[i])) for i in order]
+        totals = Counter()
+        charts = Counter()
+        for designer, value in zip(designers, values):
+            totals[designer] += max(value, 0)
+            charts[designer] += 1
+        # 总数相同时designerId小的在前，与NumPy的unique加稳定排序一致
+        return sorted(((designer, charts[designer], total) for designer, total in totals.items()),
+                      key=lambda item: (-item[2], item[0]))
+
+    def densest(self, n=10):
+        # 平均密度最高的n张谱面：(行号, musicId, 难度, 密度)；没有--analyze的数据时为空
+        density = self.columns['avgDensity']
+        music, difficulty = self.columns['musicId'], self.columns['difficulty']
+        if numpy is not None:
+            # 先用partition取出第n大的值缩小范围，再稳定排序，密度相同时行号小的在前，与没有NumPy时一致
+            valid = numpy.flatnonzero(~numpy.isnan(density))
+            if 0 < n < len(valid):
+                threshold = numpy.partition(density[valid], len(valid) - n)[len(valid) - n]
+                valid = valid[density[valid] >= threshold]
+            rows = valid[numpy.argsort(-density[valid], kind='stable')][:n]
+            return [(int(row), int(music[row]), int(difficulty[row]), float(density[row])) for row in rows]
+        rows = heapq.nlargest(n, (row for row in range(self.rows) if not math.isnan(density[row])),
+                              key=lambda row: density[row])
+        return [(row, music[row], difficulty[row], density[row]) for row in rows]
+
+
+def load(path):
+    return ChartData(path)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Summary queries over a chart statistics file written by '
+                                                     'parse.py --charts.')
+    arg_parser.add_argument('file', help='the chart statistics file, e.g. A000-charts.bin')
+    arg_parser.add_argument('--step', type=float, default=1.0,
+                            help='level step of the histogram, 0.1 keeps the decimal (default: 1)')
+    arg_parser.add_argument('--designers', type=int, default=10, metavar='N',
+                            help='number of designers with the most notes to list (default: 10)')
+    arg_parser.add_argument('--densest', type=int, default=10, metavar='N',
+                            help='number of densest charts to list, needs --analyze data (default: 10)')
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    data = load(args.file)
+    print(f'{len(data)} charts, NumPy {"on" if numpy is not None else "off"}')
+    print('\nlevel histogram:')
+    for value, count in data.level_histogram(args.step):
+        print(f'{value:>8}{count:>8}')
+    print(f'\ntop {args.designers} designers by notes (designerId, charts, notes):')
+    for designer, charts, total in data.designer_totals()[:args.designers]:
+        print(f'{designer:>8}{charts:>8}{total:>10}')
+    densest = data.densest(args.densest)
+    if densest:
+        print(f'\ntop {args.densest} densest charts (musicId, difficulty, notes/s):')
+        for _, music_id, difficulty, density in densest:
+            print(f'{music_id:>8}{difficulty:>4}{density:>10.3f}')
+    print(f'\nQueries done in {(time.perf_counter() - start) * 1000:.1f} ms')
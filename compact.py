@@ -0,0 +1,189 @@
+# 紧凑输出：所有分类写入同一个文件，字符串放入共用的字符串表，条目中只保存字符串的序号
+# Compact output: every category in one file. Strings go into a shared table and entries keep integer references.
+# Each object becomes an array [shape, values...], where the shape lists its keys once. load() rebuilds the
+# same dicts (same key order) that the json output contains.
+#
+#   {"version": 1, "strings": [...], "shapes": [[[keys...], kinds], ...], "categories": {"Music": [...], ...}}
+#
+# kinds has one letter per key: v = number, bool or null as is, s = string reference, d = object, l = list.
+# A list is [kind, items...] with the kind of its items, or ["m", [kind, item], ...] when they differ.
+# compact-bin is the same UTF-8 document compressed as a standard gzip stream (RFC 1952), readable anywhere.
+import gc
+import gzip
+import json
+import time
+
+COMPACT_VERSION = 1
+EXTENSIONS = {'compact': 'compact.json', 'compact-bin': 'compact.json.gz'}
+# gzip流的开头，读取时据此判断是否需要解压
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def value_kind(value):
+    if isinstance(value, str):
+        return 's'
+    if isinstance(value, dict):
+        return 'd'
+    if isinstance(value, list):
+        return 'l'
+    return 'v'
+
+
+class Encoder:
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        self.shapes = []
+        self.shape_ids = {}
+
+    def string(self, value):
+        index = self.string_ids.get(value)
+        if index is None:
+            index = self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def encode(self, kind, value):
+        if value is None or kind == 'v':
+            return value
+        if kind == 's':
+            return self.string(value)
+        if kind == 'd':
+            return self.encode_dict(value)
+        kinds = {value_kind(item) for item in value if item is not None}
+        if len(kinds) > 1:
+            return ['m'] + [[value_kind(item), self.encode(value_kind(item), item)] for item in value]
+        item_kind = kinds.pop() if kinds else 'v'
+        return [item_kind] + [self.encode(item_kind, item) for item in value]
+
+    def encode_dict(self, dic):
+        # 值为None的位置记为v，不影响同一形状的其他条目
+        kinds = ''.join(value_kind(value) for value in dic.values())
+        key = (tuple(dic), kinds)
+        shape = self.shape_ids.get(key)
+        if shape is None:
+            shape = self.shape_ids[key] = len(self.shapes)
+            self.shapes.append([list(dic), kinds])
+        return [shape] + [self.encode(kind, value) for kind, value in zip(kinds, dic.values())]
+
+
+class CompactWriter:
+    # 与SqliteWriter的用法相同：各分类调用save，close时写出整个文件
+    def __init__(self, path, encoding='json'):
+        self.path = path
+        self.encoding = encoding
+        self.encoder = Encoder()
+        self.categories = {}
+
+    async def save(self, json_name, fields, select, dics, metrics=None):
+        # 条目到达时立即编码，内存中只保留编码后的数组
+        rows = self.categories[json_name] = []
+        serialize = 0.0
+        async for dic in dics:
+            start = time.perf_counter()
+            rows.append(self.encoder.encode_dict(dic))
+            serialize += time.perf_counter() - start
+        if metrics is not None:
+            metrics.add('serialize', serialize)
+
+    def data(self):
+        return {'version': COMPACT_VERSION, 'strings': self.encoder.strings, 'shapes': self.encoder.shapes,
+                'categories': self.categories}
+
+    def close(self):
+        text = json.dumps(self.data(), ensure_ascii=False, separators=(',', ':')).encode()
+        if self.encoding == 'gzip':
+            # mtime固定为0，内容相同时文件也相同
+            text = gzip.compress(text, mtime=0)
+        with open(self.path, 'wb') as f:
+            f.write(text)
+
+
+def compile_decoders(shapes, strings):
+    # 每种形状生成一个直接构建字典的函数，解码时每个对象只调用一次，不再逐个值判断类型
+    # 同一形状中kind为s、d、l的值不会是None（None的位置记为v），只有列表的元素需要判断
+    decoders = []
+    source = []
+    for n, (keys, kinds) in enumerate(shapes):
+        if len(keys) != len(kinds) or not all(isinstance(key, str) for key in keys):
+            raise ValueError(f'invalid shape {n} in the compact output')
+        values = []
+        for i, (key, kind) in enumerate(zip(keys, kinds), 1):
+            if kind not in DECODE:
+                raise ValueError(f'invalid kind {kind!r} in the compact output')
+            values.append(f'{key!r}: {DECODE[kind].format(i)}')
+        source.append(f'def decode_{n}(r):\n    return {{{", ".join(values)}}}\n')
+    namespace = {'S': strings, 'D': decoders, 'decode_list': decode_list}
+    exec(''.join(source), namespace)
+    decoders.extend(namespace[f'decode_{n}'] for n in range(len(shapes)))
+    return decoders
+
+
+# 各kind的值在生成的函数中的取法，r为编码后的数组
+DECODE = {
+    'v': 'r[{0}]',
+    's': 'S[r[{0}]]',
+    'd': 'D[r[{0}][0]](r[{0}])',
+    'l': 'decode_list(r[{0}], S, D)',
+}
+
+
+def decode_value(kind, value, strings, decoders):
+    if value is None or kind == 'v':
+        return value
+    if kind == 's':
+        return strings[value]
+    if kind == 'd':
+        return decoders[value[0]](value)
+    return decode_list(value, strings, decoders)
+
+
+def decode_list(value, strings, decoders):
+    kind = value[0]
+    if kind == 'v':
+        return value[1:]
+    if kind == 's':
+        return [strings[item] if item is not None else None for item in value[1:]]
+    if kind == 'd':
+        return [decoders[item[0]](item) if item is not None else None for item in value[1:]]
+    if kind == 'm':
+        return [decode_value(item[0], item[1], strings, decoders) for item in value[1:]]
+    return [decode_list(item, strings, decoders) if item is not None else None for item in value[1:]]
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if raw.startswith(GZIP_MAGIC):
+        raw = gzip.decompress(raw)
+    data = json.loads(raw)
+    if data.get('version') != COMPACT_VERSION:
+        raise ValueError(f'{path} was written by a different version of the compact output')
+    return data
+
+
+def load(path, categories=None):
+    # 读取紧凑输出，返回 分类输出名 -> 条目字典的列表，与json输出的内容相同
+    # categories为需要的分类名（如Music），None表示全部
+    # 读取期间暂停垃圾回收：一次生成的大量列表与字典会让回收反复扫描，而其中没有循环引用
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        data = read(path)
+        strings = data['strings']
+        decoders = compile_decoders(data['shapes'], strings)
+        if isinstance(categories, str):
+            categories = [categories]
+        return {name: [decoders[row[0]](row) for row in rows] for name, rows in data['categories'].items()
+                if categories is None or name in categories}
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def write(path, categories, encoding='json'):
+    # 由 分类输出名 -> 条目字典的列表 直接写出紧凑输出
+    writer = CompactWriter(path, encoding)
+    for name, dics in categories.items():
+        writer.categories[name] = [writer.encoder.encode_dict(dic) for dic in dics]
+    writer.close()
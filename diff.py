@@ -0,0 +1,200 @@
+# 比较两个opt资源包（或两次提取的输出），按分类ID列出新增、删除与修改的条目以及修改的字段
+# Structural diff between two OPT folders, or two folders/files of earlier extraction output.
+# Entries are compared by content first; only entries whose content differs are parsed and compared field by field.
+import argparse
+import asyncio
+import hashlib
+import json
+import os.path
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import parse
+from archive import is_archive, open_file, relative_path
+from schema import Extractor, parse_fields
+
+# 输出文件中条目的第一个字段就是分类ID，不解析整个条目直接取出
+FIRST_VALUE = re.compile(r'\s*\{\s*"[^"]*":\s*(-?\d+|"(?:[^"\\]|\\.)*")')
+
+
+def entry_digest(entry):
+    # 条目的内容摘要：xml以及同目录下谱面文件的文件名和内容
+    digest = hashlib.sha1()
+    for path, _ in parse.entry_deps(entry):
+        digest.update(os.path.basename(path).encode('utf-8') + b'\0')
+        with open_file(path) as f:
+            digest.update(f.read())
+    return digest.digest()
+
+
+def root_digests(root, skip, executor):
+    # 分类输出名 -> {条目相对路径: (摘要, Entry)}，文件读取与哈希在线程池中并行
+    index = parse.scan_opt(root, skip)
+    dir_names = [dir_name for dir_name, _, _, _ in parse.categories]
+    result = {}
+    for dir_name, _, json_name, _ in parse.categories:
+        entries = index.get(dir_name)
+        if entries:
+            digests = executor.map(entry_digest, entries)
+            result[json_name] = {relative_path(entry.path, root, dir_names): (digest, entry)
+                                 for entry, digest in zip(entries, digests)}
+    return result
+
+
+async def diff_roots(old_root, new_root, skip, selects, analyze, jobs):
+    # 返回 分类输出名 -> (旧条目{ID: 字典}, 新条目{ID: 字典})，只包含内容有变化的条目，以及解析的条目数
+    with ThreadPoolExecutor() as executor:
+        old, new = root_digests(old_root, skip, executor), root_digests(new_root, skip, executor)
+    tasks = []
+    sizes = {}
+    for dir_name, _, json_name, fields in parse.categories:
+        old_entries, new_entries = old.get(json_name, {}), new.get(json_name, {})
+        changed_old = [entry for rel, (digest, entry) in old_entries.items()
+                       if rel not in new_entries or new_entries[rel][0] != digest]
+        changed_new = [entry for rel, (digest, entry) in new_entries.items()
+                       if rel not in old_entries or old_entries[rel][0] != digest]
+        if changed_old or changed_new:
+            # 新旧两边的条目放在同一个任务中解析，共用一个进程池
+            # 按ID对应新旧条目，所以总是提取ID
+            select = selects.get(dir_name)
+            if select is not None:
+                select = dict(select, **{fields[0].key: None})
+            parser = Extractor(fields, select, {'analyze': analyze})
+            tasks.append((changed_old + changed_new, json_name, parser))
+            sizes[json_name] = (len(changed_old), fields[0].key)
+    pipeline = parse.Pipeline(None, jobs, None, None)
+    await pipeline.run(tasks)
+    result = {}
+    for json_name, (count, id_key) in sizes.items():
+        dics = pipeline.results[json_name]
+        result[json_name] = ({dic[id_key]: dic for dic in dics[:count]}, {dic[id_key]: dic for dic in dics[count:]})
+    return result, sum(len(task[0]) for task in tasks)
+
+
+def split_entries(text):
+    # 把一个输出文件切成各条目的原始文本
+    if text.startswith('[\n    {'):
+        # json.dumps(indent=4)的格式：顶层条目之间是'\n    },\n'，条目内部的缩进更深，不会出现这个分隔
+        parts = text[2:-2].split('\n    },\n')
+        return [part + '\n    }' for part in parts[:-1]] + parts[-1:]
+    if text.startswith('['):
+        return [json.dumps(dic, ensure_ascii=False) for dic in json.loads(text)]
+    return [line for line in text.splitlines() if line.strip()]
+
+
+def entry_key(chunk):
+    match = FIRST_VALUE.match(chunk)
+    if match is not None:
+        return json.loads(match.group(1))
+    return next(iter(json.loads(chunk).values()), None)
+
+
+def output_files(path):
+    # 分类输出名 -> 文件；path可以是某个输出文件，也可以是存放输出的目录
+    files = {}
+    names = {json_name for _, _, json_name, _ in parse.categories}
+    for file in [path] if os.path.isfile(path) else sorted(os.path.join(path, name) for name in os.listdir(path)):
+        stem, ext = os.path.splitext(os.path.basename(file))
+        json_name = stem.rpartition('-')[2]
+        if ext in ('.json', '.ndjson') and json_name in names:
+            files[json_name] = file
+    return files
+
+
+def read_output(file):
+    if file is None:
+        return {}
+    with open(file, 'r', encoding='utf-8') as f:
+        return {entry_key(chunk): chunk for chunk in split_entries(f.read())}
+
+
+def diff_outputs(old_path, new_path):
+    old_files, new_files = output_files(old_path), output_files(new_path)
+    result = {}
+    parsed = 0
+    for _, _, json_name, _ in parse.categories:
+        if json_name not in old_files and json_name not in new_files:
+            continue
+        old, new = read_output(old_files.get(json_name)), read_output(new_files.get(json_name))
+        # 原始文本相同的条目不需要解析
+        changed_old = {key: json.loads(chunk) for key, chunk in old.items() if new.get(key) != chunk}
+        changed_new = {key: json.loads(chunk) for key, chunk in new.items() if old.get(key) != chunk}
+        parsed += len(changed_old) + len(changed_new)
+        result[json_name] = (changed_old, changed_new)
+    return result, parsed
+
+
+def field_changes(old, new, path, changes):
+    # 逐字段比较，路径用点连接，列表元素用下标；值为[旧值, 新值]，不存在的一边为None
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in list(old) + [key for key in new if key not in old]:
+            field_changes(old.get(key), new.get(key), f'{path}.{key}' if path else key, changes)
+    elif isinstance(old, list) and isinstance(new, list):
+        for i in range(max(len(old), len(new))):
+            field_changes(old[i] if i < len(old) else None, new[i] if i < len(new) else None, f'{path}.{i}', changes)
+    elif old != new:
+        changes[path] = [old, new]
+    return changes
+
+
+def changeset(changed):
+    # 由各分类有变化的条目生成变更集，只包含有变化的分类
+    categories = {}
+    for json_name, (old, new) in changed.items():
+        added = [key for key in new if key not in old]
+        removed = [key for key in old if key not in new]
+        modified = {}
+        for key, dic in new.items():
+            if key in old:
+                changes = field_changes(old[key], dic, '', {})
+                if changes:
+                    modified[str(key)] = changes
+        if added or removed or modified:
+            categories[json_name] = {'added': added, 'removed': removed, 'modified': modified}
+    return categories
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Compare two OPT folders, or two earlier extraction outputs, '
+                                                     'and list added, removed and modified entries by ID.')
+    arg_parser.add_argument('old', help='the old OPT folder or archive, or an output folder / file such as A000-Music.json')
+    arg_parser.add_argument('new', help='the new OPT folder or archive, or an output folder / file')
+    arg_parser.add_argument('-o', '--output', metavar='FILE', help='write the changeset to a JSON file')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='number of worker processes for parsing OPT folders, 0 means one per CPU (default: 1)')
+    arg_parser.add_argument('--skip', action='append', metavar='PATTERN',
+                            help='entry directory name (wildcards allowed) to skip, can be repeated '
+                                 '(default: music000000 and music000001)')
+    arg_parser.add_argument('--analyze', action='store_true', help='also compare the chart analytics')
+    arg_parser.add_argument('--fields', metavar='LIST',
+                            help='only compare these fields of OPT folders, e.g. music.bpm,music.note')
+    args = arg_parser.parse_args()
+
+    start_time = time.time()
+    # 两边都是压缩包或者有分类目录时按opt资源包比较，否则按输出文件比较
+    is_root = [is_archive(path) or os.path.isdir(path) and any(os.path.isdir(os.path.join(path, dir_name))
+                                                               for dir_name, _, _, _ in parse.categories)
+               for path in (args.old, args.new)]
+    if is_root[0] != is_root[1]:
+        arg_parser.error('compare two OPT folders or two extraction outputs, not one of each')
+    if is_root[0]:
+        changed, parsed = asyncio.run(diff_roots(
+            args.old, args.new, tuple(args.skip) if args.skip else parse.default_skip,
+            parse_fields(args.fields) if args.fields else {}, args.analyze,
+            args.jobs if args.jobs > 0 else os.cpu_count()))
+    else:
+        changed, parsed = diff_outputs(args.old, args.new)
+    categories = changeset(changed)
+
+    for json_name, category in categories.items():
+        print(f'{json_name}: {len(category["added"])} added, {len(category["removed"])} removed, '
+              f'{len(category["modified"])} modified')
+    if not categories:
+        print('No differences.')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'old': args.old, 'new': args.new, 'categories': categories},
+                               indent=4, ensure_ascii=False))
+        print(f'Changeset saved to {args.output}')
+    print(f'Parsed {parsed} changed entries in {time.time() - start_time:.3f} s')
@@ -0,0 +1,236 @@
+# ma2谱面文件的读取
+# Readers for the ma2 chart files in the opt resource package.
+import os
+from array import array
+from bisect import bisect_right
+
+# NumPy是可选的，不是依赖：安装时nps_curve与peak_density按整列计算，否则逐个音符循环，结果相同
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from archive import open_file
+
+# 统计段位于文件末尾，通常只有几百字节，先读取这么多，不够时再加倍
+TAIL_SIZE = 2048
+# 统计段各行的前缀
+STAT_PREFIXES = (b'T_', b'TTM_')
+
+
+def parse_stat_value(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def read_stats(ma2_file):
+    # 从文件末尾向前读取统计段（T_REC_*、T_NUM_*、T_JUDGE_*、TTM_*），一次取出全部字段
+    with open_file(ma2_file) as f:
+        size = f.seek(0, os.SEEK_END)
+        tail = TAIL_SIZE
+        while True:
+            start = max(0, size - tail)
+            f.seek(start)
+            lines = f.read(size - start).splitlines()
+            # 不是从文件开头读取时，第一行可能不完整
+            first = 0 if start == 0 else 1
+            stats = []
+            complete = start == 0
+            for line in reversed(lines[first:]):
+                line = line.strip()
+                if not line:
+                    continue
+                if not line.startswith(STAT_PREFIXES):
+                    # 遇到谱面内容，统计段已经读完整
+                    complete = True
+                    break
+                stats.append(line)
+            if complete:
+                break
+            tail *= 2
+    result = {}
+    for line in reversed(stats):
+        fields = line.split()
+        if len(fields) >= 2:
+            result.setdefault(fields[0].decode('ascii'), parse_stat_value(fields[1]))
+    return result
+
+
+# 音符类型：按列存储时type列中的取值
+TAP, HOLD, STAR, SLIDE, TOUCH, TOUCH_HOLD = range(6)
+# flags列中的标志位
+BREAK = 1
+EX = 2
+
+# 星星的滑动轨迹形状
+SLIDE_SHAPES = (b'SI_', b'SCL', b'SCR', b'SUL', b'SUR', b'SSL', b'SSR', b'SV_', b'SXL', b'SXR', b'SLL', b'SLR', b'SF_')
+
+
+def build_records():
+    # 记录名 -> (type, flags)，同时支持1.03（TAP、BRK、XTP…）和1.04（NMTAP、BRTAP…）两种写法
+    records = {
+        b'TAP': (TAP, 0), b'BRK': (TAP, BREAK), b'XTP': (TAP, EX),
+        b'HLD': (HOLD, 0), b'XHO': (HOLD, EX),
+        b'STR': (STAR, 0), b'BST': (STAR, BREAK), b'XST': (STAR, EX),
+        b'TTP': (TOUCH, 0), b'THO': (TOUCH_HOLD, 0),
+    }
+    prefixes = {b'NM': 0, b'BR': BREAK, b'EX': EX, b'BX': BREAK | EX}
+    for prefix, flags in prefixes.items():
+        for name, note_type in ((b'TAP', TAP), (b'HLD', HOLD), (b'STR', STAR), (b'TTP', TOUCH), (b'THO', TOUCH_HOLD)):
+            records[prefix + name] = (note_type, flags)
+    for shape in SLIDE_SHAPES:
+        records[shape] = (SLIDE, 0)
+        for prefix, flags in list(prefixes.items()) + [(b'CN', 0)]:
+            records[prefix + shape] = (SLIDE, flags)
+    return records
+
+
+RECORDS = build_records()
+
+
+class Timeline:
+    # 按列存储的谱面时间轴，每一列都是array，不为每个音符生成字典
+    __slots__ = ('resolution', 'bpm_tick', 'bpm_value', 'met_tick', 'met_value',
+                 'measure', 'tick', 'time', 'end', 'type', 'lane', 'flags')
+
+    def __init__(self):
+        self.resolution = 384
+        self.bpm_tick = array('i')
+        self.bpm_value = array('d')
+        self.met_tick = array('i')
+        self.met_value = []
+        self.measure = array('i')
+        self.tick = array('i')
+        self.time = array('d')
+        self.end = array('d')
+        self.type = array('B')
+        self.lane = array('B')
+        self.flags = array('B')
+
+    def __len__(self):
+        return len(self.time)
+
+    def count(self, note_type):
+        return self.type.count(note_type)
+
+
+def tick_to_time(ticks, bpm_tick, bpm_value, resolution):
+    # 按BPM变化分段，把绝对tick换算成秒；一小节为4拍，共resolution个tick
+    starts = [0]
+    seconds = [0.0]
+    # 没有BPM记录时按120计算
+    per_tick = [240 / ((bpm_value[0] if bpm_value else 120) * resolution)]
+    for t, bpm in zip(bpm_tick, bpm_value):
+        if t <= starts[-1]:
+            per_tick[-1] = 240 / (bpm * resolution)
+            continue
+        seconds.append(seconds[-1] + (t - starts[-1]) * per_tick[-1])
+        starts.append(t)
+        per_tick.append(240 / (bpm * resolution))
+    if len(starts) == 1:
+        step = per_tick[0]
+        return array('d', [t * step for t in ticks])
+    result = array('d')
+    for t in ticks:
+        i = bisect_right(starts, t) - 1
+        result.append(seconds[i] + (t - starts[i]) * per_tick[i])
+    return result
+
+
+def parse_notes(ma2_file):
+    # 解析谱面正文：BPM/MET变化以及全部音符记录
+    with open_file(ma2_file) as f:
+        data = f.read()
+    timeline = Timeline()
+    bpm_pairs = []
+    start_ticks = array('i')
+    end_ticks = array('i')
+    records = RECORDS
+    resolution = timeline.resolution
+    # 循环内用到的append先取出来，减少属性查找
+    add_measure, add_tick = timeline.measure.append, timeline.tick.append
+    add_type, add_lane, add_flags = timeline.type.append, timeline.lane.append, timeline.flags.append
+    add_start, add_end = start_ticks.append, end_ticks.append
+    for line in data.splitlines():
+        fields = line.split(b'\t')
+        record = records.get(fields[0])
+        if record is not None:
+            note_type, flags = record
+            measure = int(fields[1])
+            tick = int(fields[2])
+            start = measure * resolution + tick
+            if note_type == SLIDE:
+                end = start + int(fields[4]) + int(fields[5])
+            elif note_type == HOLD or note_type == TOUCH_HOLD:
+                end = start + int(fields[4])
+            else:
+                end = start
+            add_measure(measure)
+            add_tick(tick)
+            add_type(note_type)
+            add_lane(int(fields[3]))
+            add_flags(flags)
+            add_start(start)
+            add_end(end)
+        elif fields[0] == b'BPM':
+            bpm_pairs.append((int(fields[1]) * resolution + int(fields[2]), float(fields[3])))
+        elif fields[0] == b'MET':
+            timeline.met_tick.append(int(fields[1]) * resolution + int(fields[2]))
+            timeline.met_value.append((int(fields[3]), int(fields[4])))
+        elif fields[0] == b'RESOLUTION':
+            resolution = timeline.resolution = int(fields[1])
+    # BPM记录可能不按顺序，排序后再换算时间
+    bpm_pairs.sort()
+    timeline.bpm_tick = array('i', [t for t, _ in bpm_pairs])
+    timeline.bpm_value = array('d', [bpm for _, bpm in bpm_pairs])
+    timeline.time = tick_to_time(start_ticks, timeline.bpm_tick, timeline.bpm_value, timeline.resolution)
+    timeline.end = tick_to_time(end_ticks, timeline.bpm_tick, timeline.bpm_value, timeline.resolution)
+    return timeline
+
+
+def nps_curve(timeline, window=1.0):
+    # 每window秒内开始的音符数
+    if not len(timeline):
+        return []
+    if numpy is not None:
+        times = numpy.frombuffer(timeline.time, dtype=numpy.float64)
+        return numpy.bincount((times // window).astype(numpy.int64)).tolist()
+    curve = [0] * (int(max(timeline.time) // window) + 1)
+    for t in timeline.time:
+        curve[int(t // window)] += 1
+    return curve
+
+
+def peak_density(timeline, window=1.0):
+    # 任意window秒区间内音符数的最大值，返回(音符数, 区间开始时间)
+    if not len(timeline):
+        return 0, 0.0
+    times = sorted(timeline.time)
+    if numpy is not None:
+        times = numpy.asarray(times)
+        counts = numpy.searchsorted(times, times + window, side='left') - numpy.arange(len(times))
+        i = int(counts.argmax())
+        return int(counts[i]), float(times[i])
+    best, best_time, j, n = 0, 0.0, 0, len(times)
+    for i, t in enumerate(times):
+        while j < n and times[j] < t + window:
+            j += 1
+        if j - i > best:
+            best, best_time = j - i, t
+    return best, best_time
+
+
+def analyze(timeline, window=1.0):
+    # 谱面统计：按BPM换算后的长度、平均与峰值密度、每秒音符数曲线
+    length = max(timeline.end) if len(timeline) else 0.0
+    peak, peak_time = peak_density(timeline, window)
+    return {
+        "length": round(length, 3),
+        "bpmChanges": max(len(timeline.bpm_value) - 1, 0),
+        "avgDensity": round(len(timeline) / length, 3) if length else 0.0,
+        "peakDensity": peak,
+        "peakTime": round(peak_time, 3),
+        "nps": nps_curve(timeline, window)
+    }
@@ -0,0 +1,57 @@
+# 运行时的性能统计：各阶段耗时、各分类的文件数与字节数、最慢的文件
+# Run metrics for --metrics: per-phase timings, per-category counts and bytes, the slowest files.
+import heapq
+import json
+
+PHASES = ('scan', 'parse', 'ma2', 'serialize', 'write')
+
+
+class Metrics:
+    def __init__(self, top=20):
+        self.top = top
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.categories = {}
+        # 小顶堆，只保留最慢的top个文件
+        self.slowest = []
+
+    def add(self, phase, seconds):
+        self.phases[phase] += seconds
+
+    def category(self, name):
+        if name not in self.categories:
+            self.categories[name] = {'files': 0, 'parsed': 0, 'cached': 0, 'bytes': 0, 'seconds': 0.0}
+        return self.categories[name]
+
+    def add_file(self, category, path, seconds, ma2_seconds):
+        # 每个实际解析的文件：ma2部分单独计入ma2阶段，其余计入parse阶段
+        self.phases['parse'] += seconds - ma2_seconds
+        self.phases['ma2'] += ma2_seconds
+        self.category(category)['parsed'] += 1
+        item = (seconds, path, category)
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, item)
+        elif item > self.slowest[0]:
+            heapq.heapreplace(self.slowest, item)
+
+    def report(self, total):
+        files = sum(category['files'] for category in self.categories.values())
+        categories = {}
+        for name, category in self.categories.items():
+            categories[name] = dict(category, seconds=round(category['seconds'], 6),
+                                    filesPerSec=round(category['files'] / category['seconds'], 1)
+                                    if category['seconds'] else 0.0)
+        return {
+            'total': round(total, 6),
+            'files': files,
+            'bytes': sum(category['bytes'] for category in self.categories.values()),
+            'filesPerSec': round(files / total, 1) if total else 0.0,
+            # 多进程时parse与ma2是各进程耗时之和，可能超过总时间
+            'phases': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            'categories': categories,
+            'slowest': [{'path': path, 'category': category, 'seconds': round(seconds, 6)}
+                        for seconds, path, category in sorted(self.slowest, reverse=True)],
+        }
+
+    def save(self, path, total):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self.report(total), indent=4, ensure_ascii=False))
@@ -1,36 +1,333 @@
 # 用于对opt资源包中的信息进行快速提取
 # Used for quick extraction of information in the opt resource package.
 # - Kyoku 2024.03
+import argparse
 import asyncio
+import cProfile
+import fnmatch
+import functools
+import hashlib
 import json
-import re
 import os.path
 import sys
 import time
-import xml.etree.ElementTree as et
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import NamedTuple
 
-# 全局变量
-opt_name = None
+import compact
+import ma2
+from archive import archive_opt_name, file_stat, io_wait, is_archive, open_file, scan_archive
+from assets import build_manifest, load_manifest, manifest_changes, save_manifest
+from charts import CHART_FIELDS, ChartTable
+from metrics import Metrics
+from prefetch import prefetched
+from schema import Extractor, Field, Group, Items, add_select, parse_fields, unknown_fields
+from sqlite_export import SqliteWriter
+from xref import REFERENCES, CrossIndex
+
+# 提取结构的版本，修改任何输出字段时需要加一，旧的缓存会随之失效
+SCHEMA_VERSION = 1
+# --max-memory按条目依赖文件大小的倍数估算解析时占用的内存
+MEMORY_FACTOR = 4
+# 默认跳过的条目目录（支持通配符）
+default_skip = ('music000000', 'music000001')
 str_to_bool = {'true': True, 'false': False}
 
 
-async def get_file_by_path_n_name(path, file_name):
-    # 初始化存储path的列表
-    path_list = []
-    # 从目录下找到所有文件
-    for filepath, dirname, filename in os.walk(path):
-        if 'music000000' not in filepath and 'music000001' not in filepath:
-            if not filename == [] and 'Sort.xml' not in str(filename):
-                path = os.path.join(filepath, file_name)
-                path_list.append(path)
-    # 返回获取的数据文件列表
-    return path_list
+# 条目索引：条目目录、xml文件路径、xml文件的stat、目录下其余文件的文件名、合并时条目所在的opt
+class Entry(NamedTuple):
+    path: str
+    xml: str
+    stat: os.stat_result
+    files: tuple = ()
+    opt: str = None
+
+
+def scan_category(path, file_name, skip, entries):
+    # 用scandir递归查找含有指定xml的条目目录，只对实际存在的文件建立索引
+    xml = None
+    dirs = []
+    files = []
+    io_wait()
+    with os.scandir(path) as it:
+        for item in it:
+            if any(fnmatch.fnmatchcase(item.name, pattern) for pattern in skip):
+                continue
+            if item.is_dir(follow_symlinks=False):
+                dirs.append(item)
+            elif item.name == file_name:
+                xml = item
+            else:
+                files.append(item.name)
+    if xml is not None:
+        entries.append(Entry(path, xml.path, xml.stat(), tuple(sorted(files))))
+    # 按名称排序，保证在不同文件系统上得到相同的顺序
+    for item in sorted(dirs, key=lambda d: d.name):
+        scan_category(item.path, file_name, skip, entries)
+
+
+def scan_opt(root, skip=default_skip, workers=1):
+    # 一次遍历opt根目录，建立 分类目录名 -> [Entry] 的索引；root也可以是zip/tar压缩包
+    # workers大于1时各分类目录在线程池中同时扫描，用于延迟较高的存储
+    file_names = {dir_name: file_name for dir_name, file_name, _, _ in categories}
+    if is_archive(root):
+        return {dir_name: [Entry(*item) for item in items]
+                for dir_name, items in scan_archive(root, file_names, skip).items()}
+    with os.scandir(root) as it:
+        dirs = [(item.name, item.path) for item in it if item.name in file_names and item.is_dir()]
+
+    def scan(dir_name, path):
+        entries = []
+        scan_category(path, file_names[dir_name], skip, entries)
+        return entries
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip((dir_name for dir_name, _ in dirs), executor.map(lambda item: scan(*item), dirs)))
+    return {dir_name: scan(dir_name, path) for dir_name, path in dirs}
+
+
+def opt_name_of(root):
+    if is_archive(root):
+        return archive_opt_name(root, [dir_name for dir_name, _, _, _ in categories])
+    return os.path.basename(os.path.normpath(root))
+
+
+def scan_layers(roots, skip=default_skip, workers=1):
+    # 同时扫描多个opt目录，按opt名称排序（游戏加载的顺序）后把各分类的条目依次连接起来
+    roots = sorted(roots, key=opt_name_of)
+    with ThreadPoolExecutor(max_workers=len(roots)) as executor:
+        indexes = list(executor.map(lambda root: scan_opt(root, skip, workers), roots))
+    index = {}
+    for root, layer in zip(roots, indexes):
+        for dir_name, entries in layer.items():
+            index.setdefault(dir_name, []).extend(entry._replace(opt=opt_name_of(root)) for entry in entries)
+    return index
+
+
+def merge_dics(pairs, id_key):
+    # pairs为按层顺序排列的(opt, 字典)；ID相同的条目由后面的opt覆盖，位置保持第一次出现时的位置
+    # opt记录条目最终来自哪个opt，overrides为依次被覆盖的opt
+    merged = {}
+    for opt, dic in pairs:
+        old = merged.get(dic[id_key])
+        merged[dic[id_key]] = dict(dic, opt=opt, overrides=old['overrides'] + [old['opt']] if old else [])
+    return list(merged.values())
+
+
+async def merge_layers(results, id_key):
+    # results为按条目顺序的(条目, 字典)，解析失败而略去的条目不会让后面的字典对应到错误的opt
+    pairs = []
+    async for entry, dic in results:
+        pairs.append((entry.opt, dic))
+    for dic in merge_dics(pairs, id_key):
+        yield dic
+
+
+def entry_files(entry):
+    # 条目解析时依赖的文件：xml本身以及同目录下的谱面文件
+    return [entry.xml] + [os.path.join(entry.path, name) for name in entry.files if name.endswith('.ma2')]
+
+
+def entry_deps(entry):
+    # 依赖文件及其stat，xml的stat来自扫描
+    files = entry_files(entry)
+    return [(entry.xml, entry.stat)] + [(path, file_stat(path)) for path in files[1:]]
+
+
+def stat_entries(entries, workers=1):
+    # 各条目的entry_deps；workers大于1时与预读一样在有上限的线程池中stat，用于延迟较高的存储
+    if workers <= 1:
+        return [entry_deps(entry) for entry in entries]
+    # 每个线程任务stat一组条目，避免逐个提交的开销超过stat本身
+    size = max(1, min(64, -(-len(entries) // (workers * 4))))
+    groups = [entries[i:i + size] for i in range(0, len(entries), size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return [deps for group in executor.map(lambda group: [entry_deps(entry) for entry in group], groups)
+                for deps in group]
+
+
+def file_hash(path):
+    with open_file(path) as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class Manifest:
+    # 增量提取用的缓存清单，按路径、大小、修改时间（可选内容哈希）记录每个条目已生成的字典
+    def __init__(self, path, use_hash=False, config=None):
+        self.path = path
+        self.use_hash = use_hash
+        self.config = config or {}
+        self.entries = {}
+        self.seen = set()
+        self.hits = 0
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # 提取结构版本或者影响输出的选项不一致时整个缓存作废
+            if data.get('version') == SCHEMA_VERSION and data.get('config', {}) == self.config:
+                self.entries = data['entries']
+
+    def get(self, entry, deps):
+        # deps为entry_deps(entry)，由Pipeline统一stat
+        self.seen.add(entry.xml)
+        record = self.entries.get(entry.xml)
+        if record is None:
+            return None
+        if len(deps) != len(record['deps']):
+            return None
+        for (path, st), dep in zip(deps, record['deps']):
+            if dep[0] != path or dep[1] != st.st_size:
+                return None
+            if dep[2] != st.st_mtime_ns:
+                # 修改时间变化但内容哈希相同时仍然可以使用缓存
+                if dep[3] is None or dep[3] != file_hash(path):
+                    return None
+                dep[2] = st.st_mtime_ns
+        self.hits += 1
+        return record['dic']
+
+    def put(self, entry, dic, deps):
+        self.seen.add(entry.xml)
+        self.entries[entry.xml] = {
+            'deps': [[path, st.st_size, st.st_mtime_ns, file_hash(path) if self.use_hash else None]
+                     for path, st in deps],
+            'dic': dic
+        }
+
+    def save(self):
+        # 只保留本次运行中仍然存在的条目
+        entries = {key: record for key, record in self.entries.items() if key in self.seen}
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'version': SCHEMA_VERSION, 'config': self.config, 'entries': entries}, f, ensure_ascii=False)
+
+
+class Journal:
+    # --journal：每个条目完成后立即追加一行到日志文件（成功时为字典，失败时为错误），中途崩溃或中断也不会丢失
+    # 再次运行时依赖文件未变化的成功条目直接取用，失败和未完成的条目重新解析
+    def __init__(self, path, config=None):
+        self.path = path
+        self.config = config or {}
+        self.records = {}
+        self.seen = set()
+        self.hits = 0
+        header = {'version': SCHEMA_VERSION, 'config': self.config}
+        valid = False
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for i, line in enumerate(f):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时最后一行可能没有写完
+                        break
+                    if i == 0:
+                        # 提取结构版本或者影响输出的选项不一致时整个日志作废
+                        valid = record == header
+                        if not valid:
+                            break
+                    else:
+                        self.records[record['xml']] = record
+        if not valid:
+            self.records = {}
+        self.file = open(path, 'a' if valid else 'w', encoding='utf-8')
+        if not valid:
+            self.write(header)
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self.file.flush()
+
+    def get(self, entry, deps):
+        self.seen.add(entry.xml)
+        record = self.records.get(entry.xml)
+        if record is None or 'dic' not in record:
+            return None
+        if record['deps'] != [[path, st.st_size, st.st_mtime_ns] for path, st in deps]:
+            return None
+        self.hits += 1
+        return record['dic']
+
+    def put(self, entry, dic, deps):
+        # dic为ParseFailure时记录错误
+        self.seen.add(entry.xml)
+        record = {'xml': entry.xml, 'deps': [[path, st.st_size, st.st_mtime_ns] for path, st in deps]}
+        if isinstance(dic, ParseFailure):
+            record['error'] = dic._asdict()
+        else:
+            record['dic'] = dic
+        self.records[entry.xml] = record
+        self.write(record)
+
+    def close(self, compact=True):
+        # 正常结束时压缩日志，只保留本次运行中仍然存在的条目的最后一条记录；中途结束时seen并不完整，不能压缩
+        self.file.close()
+        if not compact:
+            return
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'version': SCHEMA_VERSION, 'config': self.config}, ensure_ascii=False) + '\n')
+            for xml, record in self.records.items():
+                if xml in self.seen:
+                    f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        os.replace(self.path + '.tmp', self.path)
+
 
+# save_to_json每次序列化的条目数
+SERIALIZE_BATCH = 64
 
-async def save_to_json(json_name, dic):
-    with open(f'{opt_name}-{json_name}.json', 'w+', encoding='utf-8') as j:
-        j.write(json.dumps(dic, indent=4, ensure_ascii=False))
-        j.close()
+
+def format_entry(dic, output_format='json'):
+    # 单个条目的文本：json格式为数组中缩进好的对象（不含前后的分隔），ndjson格式为一行
+    if output_format == 'ndjson':
+        return json.dumps(dic, ensure_ascii=False, separators=(',', ':')) + '\n'
+    return json.dumps(dic, indent=4, ensure_ascii=False).replace('\n', '\n    ')
+
+
+def join_entries(texts, output_format='json'):
+    # 由各条目的文本拼出整个文件，结果与save_to_json写出的相同
+    if output_format == 'ndjson':
+        return ''.join(texts)
+    return '[\n    ' + ',\n    '.join(texts) + '\n]' if texts else '[]'
+
+
+def format_batch(dics, output_format='json'):
+    # 一批条目的文本：json格式整批交给json.dumps(indent=4)再去掉外层的方括号，不用逐个条目替换换行来缩进
+    if output_format == 'ndjson':
+        return ''.join(format_entry(dic, output_format) for dic in dics)
+    return json.dumps(dics, indent=4, ensure_ascii=False)[2:-2]
+
+
+async def save_to_json(file_name, dics, output_format='json', metrics=None):
+    # 流式写出：条目按SERIALIZE_BATCH个一批序列化后写入文件，不在内存中拼出整个列表
+    # json格式与json.dumps(indent=4)的结果完全相同；ndjson格式每行一个紧凑的条目
+    serialize = write = 0.0
+    count = 0
+    with open(file_name, 'w', encoding='utf-8') as j:
+        def flush(batch):
+            nonlocal serialize, write, count
+            start = time.perf_counter()
+            text = format_batch(batch, output_format)
+            if output_format != 'ndjson':
+                text = (',\n' if count else '[\n') + text
+            middle = time.perf_counter()
+            j.write(text)
+            serialize += middle - start
+            write += time.perf_counter() - middle
+            count += len(batch)
+
+        batch = []
+        async for dic in dics:
+            batch.append(dic)
+            if len(batch) == SERIALIZE_BATCH:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+        if output_format != 'ndjson':
+            j.write('\n]' if count else '[]')
+    if metrics is not None:
+        metrics.add('serialize', serialize)
+        metrics.add('write', write)
 
 
 def rgb_to_hex(r, g, b):
@@ -41,514 +338,781 @@ def rgb_to_hex(r, g, b):
 
 
 def ma2_reader(ma2_file):
-    if os.path.exists(ma2_file):
-        # 读取ma2文件
-        with open(ma2_file, 'r') as f:
-            ma2 = f.read()
-            f.close()
-        num_tap = int(next(iter(re.findall(r"T_NUM_TAP\s(\d+)", ma2)), '0'))
-        # print(num_tap)
-        num_break = int(next(iter(re.findall(r"T_NUM_BRK\s(\d+)", ma2)), '0'))
-        # print(num_break)
-        num_hold = int(next(iter(re.findall(r"T_NUM_HLD\s(\d+)", ma2)), '0'))
-        # print(num_hold)
-        num_slide = int(next(iter(re.findall(r"T_NUM_SLD\s(\d+)", ma2)), '0'))
-        # print(num_slide)
-        num_all = int(next(iter(re.findall(r"T_NUM_ALL\s(\d+)", ma2)), '0'))
-        # print(num_all)
-        # 传出获取到的值
-        return num_tap, num_break, num_hold, num_slide, num_all
-
-
-async def challenge_parse(path):
-    xml_list = await get_file_by_path_n_name(path, 'Challenge.xml')
-    dics = []
-    for xmlfile in xml_list:
-        root = et.parse(xmlfile).getroot()
-        # 获取解限信息
-        relax_data = root.find('Relax')
-        all_relaxs = relax_data.findall('ChallengeRelax')
-        relax_dics = []
-        for relax in all_relaxs:
-            relax_dic = {
-                "passDays": int(relax.find('Day').text),
-                "lifeLimit": int(relax.find('Life').text),
-                "difficult": int(relax.find('ReleaseDiff').find('id').text)
-            }
-            relax_dics.append(relax_dic)
-        # 生成字典
-        dic = {
-            "challengeId": int(root.find('name').find('id').text),
-            "challengeName": root.find('name').find('str').text,
-            "music": {
-                "musicId": int(root.find('Music').find('id').text),
-                "musicName": root.find('Music').find('str').text
-            },
-            "event": {
-                "eventId": int(root.find('EventName').find('id').text),
-                "eventName": root.find('EventName').find('str').text
-            },
-            "relaxData": relax_dics
-        }
-        dics.append(dic)
-    await save_to_json('Challenge', dics)
+    # 只读取文件末尾的统计段，文件不存在时返回None
+    try:
+        stats = ma2.read_stats(ma2_file)
+    except FileNotFoundError:
+        return None
+    # 传出获取到的值
+    return (stats.get('T_NUM_TAP', 0), stats.get('T_NUM_BRK', 0), stats.get('T_NUM_HLD', 0),
+            stats.get('T_NUM_SLD', 0), stats.get('T_NUM_ALL', 0))
 
 
-async def chara_parse(path):
-    xml_list = await get_file_by_path_n_name(path, 'Chara.xml')
-    dics = []
-    for xmlfile in xml_list:
-        root = et.parse(xmlfile).getroot()
-        # 构建字典
-        dic = {
-            "charaId": int(root.find('name').find('id').text),
-            "charaName": root.find('name').find('str').text,
-            "colorId": int(root.find('color').find('id').text),
-            "colorName": root.find('color').find('str').text,
-            "genreId": int(root.find('genre').find('id').text),
-            "isDisabled": str_to_bool[root.find('disable').text]
-        }
-        dics.append(dic)
-    await save_to_json('Chara', dics)
+# 字段转换函数，接收(元素, 上下文)
+def text(e, ctx):
+    return e.text
 
 
-async def chara_genre_parse(path):
-    xml_list = await get_file_by_path_n_name(path, 'CharaGenre.xml')
-    dics = []
-    for xmlfile in xml_list:
-        root = et.parse(xmlfile).getroot()
-        # 构建字典
-        dic = {
-            "charaGenreId": int(root.find('name').find('id').text),
-            "charaGenreName": root.find('name').find('str').text,
-            "charaGenreNameCN": root.find('genreName').text,
-            "color": rgb_to_hex(root.find('Color').find('R').text,
-                                root.find('Color').find('G').text,
-                                root.find('Color').find('B').text),
-            "resourceName": root.find('FileName').text,
-            "isDisabled": str_to_bool[root.find('disable').text]
-        }
-        dics.append(dic)
-    await save_to_json('CharaGenre', dics)
+def integer(e, ctx):
+    return int(e.text)
 
 
-async def collection_genre_parse(path):
-    xml_list = await get_file_by_path_n_name(path, 'CollectionGenre.xml')
-    dics = []
-    for xmlfile in xml_list:
-        root = et.parse(xmlfile).getroot()
-        # 构建字典
-        dic = {
-            "collectionGenreId": int(root.find('name').find('id').text),
-            "collectionGenreName": root.find('name').find('str').text,
-            "collectionGenreNameCN": root.find('genreName').text,
-            "color": rgb_to_hex(root.find('Color').find('R').text,
-                                root.find('Color').find('G').text,
-                                root.find('Color').find('B').text),
-            "resourceName": root.find('FileName').text,
-            "isDisabled": str_to_bool[root.find('disable').text]
-        }
-        dics.append(dic)
-    await save_to_json('CollectionGenre', dics)
+def number(e, ctx):
+    return float(e.text)
 
 
-async def course_parse(path):
-    xml_list = await get_file_by_path_n_name(path, 'Course.xml')
-    dics = []
-    for xmlfile in xml_list:
-        root = et.parse(xmlfile).getroot()
-        is_random = str_to_bool[root.find('isRandom').text]
-        # 获取课题曲信息
-        music_data = root.find('courseMusicData')
-        all_musics = music_data.findall('CourseMusicData')
-        music_dics = []
-        for music in all_musics:
-            music_dic = {
-                "musicId": int(music.find('musicId').find('id').text),
-                "musicName": music.find('musicId').find('str').text,
-                "difficulty": int(music.find('difficulty').find('id').text)
-            }
-            music_dics.append(music_dic)
-        # 构建字典
-        dic = {
-            "courseId": int(root.find('name').find('id').text),
-            "cureseName": root.find('name').find('str').text,
-            "courseMode": int(root.find('courseMode').find('id').text),
-            "baseDaniId": int(root.find('baseDaniId').find('id').text),
-            "baseDaniName": root.find('baseDaniId').find('str').text,
-            "baseCourseId": int(root.find('baseCourseId').find('id').text),
-            "baseCourseName": root.find('baseCourseId').find('str').text,
-            "eventId": int(root.find('eventId').find('id').text),
-            "eventName": root.find('eventId').find('str').text,
-            "courseInfo": {
-                "isRandom": is_random,
-                "maxLevel": int(root.find('upperLevel').text),
-                "minLevel": int(root.find('lowerLevel').text),
-                "isLock": str_to_bool[root.find('isLock').text],
-                "life": int(root.find('life').text),
-                "recover": int(root.find('recover').text),
-                "perfectDamage": int(root.find('perfectDamage').text),
-                "greatDamage": int(root.find('greatDamage').text),
-                "goodDamage": int(root.find('goodDamage').text),
-                "missDamage": int(root.find('missDamage').text),
-            },
-            "courseMusic": music_dics if not is_random else []
-        }
-        dics.append(dic)
-    await save_to_json('Course', dics)
+def boolean(e, ctx):
+    return str_to_bool[e.text]
 
 
-async def event_parse(path):
-    xml_list = await get_file_by_path_n_name(path, 'Event.xml')
-    dics = []
-    for xmlfile in xml_list:
-        root = et.parse(xmlfile).getroot()
-        # 构建字典
-        dic = {
-            "eventId": int(root.find('name').find('id').text),
-            "eventName": root.find('name').find('str').text,
-            "infoType": int(root.find('infoType').text),
-            "alwaysOpen": str_to_bool[root.find('alwaysOpen').text]
-        }
-        dics.append(dic)
-    await save_to_json('Event', dics)
+def color(e, ctx):
+    return rgb_to_hex(e.find('R').text, e.find('G').text, e.find('B').text)
 
 
-async def frame_parse(path):
-    xml_list = await get_file_by_path_n_name(path, 'Frame.xml')
-    dics = []
-    for xmlfile in xml_list:
-        root = et.parse(xmlfile).getroot()
-        # 构建字典
-        dic = {
-            "frameId": int(root.find('name').find('id').text),
-            "frameName": root.find('name').find('str').text,
-            "frameInfo": {
-                "releaseVersion": root.find('releaseTagName').find('str').text,
-                "netOpen": root.find('netOpenName').find('str').text,
-                "eventId": int(root.find('eventName').find('id').text),
-                "collectionGenre": int(root.find('genre').find('id').text),
-                "isDisabled": str_to_bool[root.find('disable').text],
-                "isDefault": str_to_bool[root.find('isDefault').text],
-                "isEffect": str_to_bool[root.find('isEffect').text],
-                "dispCond": root.find('dispCond').text,
-                "text": root.find('normText').text
-            }
-        }
-        dics.append(dic)
-    await save_to_json('Frame', dics)
+def level(e, ctx):
+    return int(e.find('level').text) + int(e.find('levelDecimal').text) / 10
 
 
-async def icon_parse(path):
-    xml_list = await get_file_by_path_n_name(path, 'Icon.xml')
-    dics = []
-    for xmlfile in xml_list:
-        root = et.parse(xmlfile).getroot()
-        # 构建字典
-        dic = {
-            "iconId": int(root.find('name').find('id').text),
-            "iconName": root.find('name').find('str').text,
-            "iconInfo": {
-                "releaseVersion": root.find('releaseTagName').find('str').text,
-                "netOpen": root.find('netOpenName').find('str').text,
-                "eventId": int(root.find('eventName').find('id').text),
-                "collectionGenre": int(root.find('genre').find('id').text),
-                "isDisabled": str_to_bool[root.find('disable').text],
-                "isDefault": str_to_bool[root.find('isDefault').text],
-                "dispCond": root.find('dispCond').text,
-                "text": root.find('normText').text
-            }
-        }
-        dics.append(dic)
-    await save_to_json('Icon', dics)
+def volume(e, ctx):
+    start = time.perf_counter()
+    note_num = ma2_reader(os.path.join(ctx['dir'], e.text))
+    ctx['ma2'] += time.perf_counter() - start
+    return {
+        "tap": note_num[0] if note_num else 0,
+        "break": note_num[1] if note_num else 0,
+        "hold": note_num[2] if note_num else 0,
+        "slide": note_num[3] if note_num else 0,
+        "all": note_num[4] if note_num else 0
+    }
 
 
-async def login_bonus_parse(path):
-    xml_list = await get_file_by_path_n_name(path, 'LoginBonus.xml')
-    dics = []
-    for xmlfile in xml_list:
-        root = et.parse(xmlfile).getroot()
-        # 构建字典
-        dic = {
-            "loginBonusId": int(root.find('name').find('id').text),
-            "loginBonusName": root.find('name').find('str').text,
-            "itemId": int(root.find('itemID').text),
-            "eventId": int(root.find('OpenEventId').find('id').text),
-            "bonusType": root.find('BonusType').text,
-            "bonusValue": {
-                "partnerId": int(root.find('PartnerId').find('id').text),
-                "partnerName": root.find('PartnerId').find('str').text,
-                "characterId": int(root.find('CharacterId').find('id').text),
-                "characterName": root.find('CharacterId').find('str').text,
-                "musicId": int(root.find('MusicId').find('id').text),
-                "musicName": root.find('MusicId').find('str').text,
-                "titleId": int(root.find('TitleId').find('id').text),
-                "titleName": root.find('TitleId').find('str').text,
-                "plateId": int(root.find('PlateId').find('id').text),
-                "plateName": root.find('PlateId').find('str').text,
-                "iconId": int(root.find('IconId').find('id').text),
-                "iconName": root.find('IconId').find('str').text,
-                "frameId": int(root.find('FrameId').find('id').text),
-                "frameName": root.find('FrameId').find('str').text,
-                "ticketId": int(root.find('TicketId').find('id').text),
-                "ticketName": root.find('TicketId').find('str').text,
-            },
-            "bonusInfo": {
-                "maxPoint": int(root.find('maxPoint').text),
-                "isRepeatGet": str_to_bool[root.find('IsRepeatGet').text],
-                "isCollabo": str_to_bool[root.find('IsCollabo').text],
-            }
-        }
-        dics.append(dic)
-    await save_to_json('LoginBonus', dics)
+def chart(e, ctx):
+    # 解析谱面正文并计算密度等统计，文件不存在时为None
+    start = time.perf_counter()
+    try:
+        return ma2.analyze(ma2.parse_notes(os.path.join(ctx['dir'], e.text)))
+    except FileNotFoundError:
+        return None
+    finally:
+        ctx['ma2'] += time.perf_counter() - start
 
 
-async def map_parse(path):
-    xml_list = await get_file_by_path_n_name(path, 'Map.xml')
-    dics = []
-    for xmlfile in xml_list:
-        root = et.parse(xmlfile).getroot()
-        map_details = []
-        detail_data = root.find('TreasureExDatas')
-        details = detail_data.findall('MapTreasureExData')
-        for detail in details:
-            map_detail = {
-                "distance": int(detail.find('Distance').text),
-                "flag": detail.find('Flag').text,
-                "subParam1": int(detail.find('SubParam1').text),
-                "subParam2": int(detail.find('SubParam2').text),
-                "treasureId": int(detail.find('TreasureId').find('id').text),
-                "treasureName": detail.find('TreasureId').find('str').text,
-            }
-            map_details.append(map_detail)
-        # 构建字典
-        dic = {
-            "mapId": int(root.find('name').find('id').text),
-            "mapName": root.find('name').find('str').text,
-            "islandId": int(root.find('IslandId').find('id').text),
-            "islandName": root.find('IslandId').find('str').text,
-            "colorId": int(root.find('ColorId').find('id').text),
-            "colorName": root.find('ColorId').find('str').text,
-            "bonusMusicId": int(root.find('BonusMusicId').find('id').text),
-            "bonusMusicName": root.find('BonusMusicId').find('str').text,
-            "eventId": int(root.find('OpenEventId').find('id').text),
-            "bonusMusicMagnification": int(root.find('BonusMusicMagnification').text),
-            "mapInfo": {
-                "isCollabo": str_to_bool[root.find('IsCollabo').text],
-                "isInfinity": str_to_bool[root.find('IsInfinity').text],
-            },
-            "mapDetail": map_details
-        }
-        dics.append(dic)
-    await save_to_json('Map', dics)
+def list_index(e, ctx):
+    # 列表元素在xml中的位置
+    return ctx['index']
 
 
-async def map_bonus_music_parse(path):
-    xml_list = await get_file_by_path_n_name(path, 'MapBonusMusic.xml')
-    dics = []
-    for xmlfile in xml_list:
-        root = et.parse(xmlfile).getroot()
-        music_details = []
-        music_data = root.find('MusicIds')
-        details = music_data.find('list').findall('StringID')
-        for detail in details:
-            music_detail = {
-                "musicId": int(detail.find('id').text),
-                "musicName": detail.find('str').text,
-            }
-            music_details.append(music_detail)
-        # 构建字典
-        dic = {
-            "mapBonusId": int(root.find('name').find('id').text),
-            "mapBonusName": root.find('name').find('str').text,
-            "musicList": music_details
-        }
-        dics.append(dic)
-    await save_to_json('MapBonusMusic', dics)
+def has_level(e):
+    # 等级为0的谱面不存在
+    return e.find('level').text != '0'
 
 
-async def map_color_parse(path):
-    xml_list = await get_file_by_path_n_name(path, 'MapColor.xml')
-    dics = []
-    for xmlfile in xml_list:
-        root = et.parse(xmlfile).getroot()
-        # 构建字典
-        dic = {
-            "mapColorId": int(root.find('name').find('id').text),
-            "mapColorName": root.find('name').find('str').text,
-            "colorGroupId": int(root.find('ColorGroupId').find('id').text),
-            "colorGroupName": root.find('ColorGroupId').find('str').text,
-            "color": rgb_to_hex(root.find('Color').find('R').text,
-                                root.find('Color').find('G').text,
-                                root.find('Color').find('B').text),
-            "colorDark": rgb_to_hex(root.find('ColorDark').find('R').text,
-                                    root.find('ColorDark').find('G').text,
-                                    root.find('ColorDark').find('B').text),
-        }
-        dics.append(dic)
-    await save_to_json('MapColor', dics)
+def id_str(id_key, str_key, path):
+    # 大部分引用都是<id>与<str>成对出现，path为空时就在当前元素下
+    prefix = f'{path}/' if path else ''
+    return Field(id_key, f'{prefix}id', integer), Field(str_key, f'{prefix}str', text)
 
 
-async def map_treasure_parse(path):
-    xml_list = await get_file_by_path_n_name(path, 'MapTreasure.xml')
-    dics = []
-    for xmlfile in xml_list:
-        root = et.parse(xmlfile).getroot()
-        # 构建字典
-        dic = {
-            "treasureId": int(root.find('name').find('id').text),
-            "treasureName": root.find('name').find('str').text,
-            "treasureType": root.find('TreasureType').text,
-            "treasureDetail": {
-                "characterId": int(root.find('CharacterId').find('id').text),
-                "characterName": root.find('CharacterId').find('str').text,
-                "musicId": int(root.find('MusicId').find('id').text),
-                "musicName": root.find('MusicId').find('str').text,
-                "numeric": int(root.find('Numeric').text),
-                "namePlateId": int(root.find('NamePlate').find('id').text),
-                "namePlateName": root.find('NamePlate').find('str').text,
-                "frameId": int(root.find('Frame').find('id').text),
-                "frameName": root.find('Frame').find('str').text,
-                "titleId": int(root.find('Title').find('id').text),
-                "titleName": root.find('Title').find('str').text,
-                "iconId": int(root.find('Icon').find('id').text),
-                "iconName": root.find('Icon').find('str').text,
-                "challengeId": int(root.find('Challenge').find('id').text),
-                "challengeName": root.find('Challenge').find('str').text,
-            }
-        }
-        dics.append(dic)
-    await save_to_json('MapTreasure', dics)
+challenge_fields = (
+    *id_str('challengeId', 'challengeName', 'name'),
+    Group('music', id_str('musicId', 'musicName', 'Music')),
+    Group('event', id_str('eventId', 'eventName', 'EventName')),
+    Items('relaxData', 'Relax/ChallengeRelax', (
+        Field('passDays', 'Day', integer),
+        Field('lifeLimit', 'Life', integer),
+        Field('difficult', 'ReleaseDiff/id', integer),
+    )),
+)
+
+chara_fields = (
+    *id_str('charaId', 'charaName', 'name'),
+    *id_str('colorId', 'colorName', 'color'),
+    Field('genreId', 'genre/id', integer),
+    Field('isDisabled', 'disable', boolean),
+)
+
+chara_genre_fields = (
+    *id_str('charaGenreId', 'charaGenreName', 'name'),
+    Field('charaGenreNameCN', 'genreName', text),
+    Field('color', 'Color', color),
+    Field('resourceName', 'FileName', text),
+    Field('isDisabled', 'disable', boolean),
+)
+
+collection_genre_fields = (
+    *id_str('collectionGenreId', 'collectionGenreName', 'name'),
+    Field('collectionGenreNameCN', 'genreName', text),
+    Field('color', 'Color', color),
+    Field('resourceName', 'FileName', text),
+    Field('isDisabled', 'disable', boolean),
+)
 
+course_fields = (
+    *id_str('courseId', 'cureseName', 'name'),
+    Field('courseMode', 'courseMode/id', integer),
+    *id_str('baseDaniId', 'baseDaniName', 'baseDaniId'),
+    *id_str('baseCourseId', 'baseCourseName', 'baseCourseId'),
+    *id_str('eventId', 'eventName', 'eventId'),
+    Group('courseInfo', (
+        Field('isRandom', 'isRandom', boolean),
+        Field('maxLevel', 'upperLevel', integer),
+        Field('minLevel', 'lowerLevel', integer),
+        Field('isLock', 'isLock', boolean),
+        Field('life', 'life', integer),
+        Field('recover', 'recover', integer),
+        Field('perfectDamage', 'perfectDamage', integer),
+        Field('greatDamage', 'greatDamage', integer),
+        Field('goodDamage', 'goodDamage', integer),
+        Field('missDamage', 'missDamage', integer),
+    )),
+    # 随机课题时没有固定的课题曲
+    Items('courseMusic', 'courseMusicData/CourseMusicData', (
+        *id_str('musicId', 'musicName', 'musicId'),
+        Field('difficulty', 'difficulty/id', integer),
+    ), when=('isRandom', 'false')),
+)
 
-async def music_parse(path):
-    xml_list = await get_file_by_path_n_name(path, 'Music.xml')
+event_fields = (
+    *id_str('eventId', 'eventName', 'name'),
+    Field('infoType', 'infoType', integer),
+    Field('alwaysOpen', 'alwaysOpen', boolean),
+)
+
+frame_fields = (
+    *id_str('frameId', 'frameName', 'name'),
+    Group('frameInfo', (
+        Field('releaseVersion', 'releaseTagName/str', text),
+        Field('netOpen', 'netOpenName/str', text),
+        Field('eventId', 'eventName/id', integer),
+        Field('collectionGenre', 'genre/id', integer),
+        Field('isDisabled', 'disable', boolean),
+        Field('isDefault', 'isDefault', boolean),
+        Field('isEffect', 'isEffect', boolean),
+        Field('dispCond', 'dispCond', text),
+        Field('text', 'normText', text),
+    )),
+)
+
+icon_fields = (
+    *id_str('iconId', 'iconName', 'name'),
+    Group('iconInfo', (
+        Field('releaseVersion', 'releaseTagName/str', text),
+        Field('netOpen', 'netOpenName/str', text),
+        Field('eventId', 'eventName/id', integer),
+        Field('collectionGenre', 'genre/id', integer),
+        Field('isDisabled', 'disable', boolean),
+        Field('isDefault', 'isDefault', boolean),
+        Field('dispCond', 'dispCond', text),
+        Field('text', 'normText', text),
+    )),
+)
+
+login_bonus_fields = (
+    *id_str('loginBonusId', 'loginBonusName', 'name'),
+    Field('itemId', 'itemID', integer),
+    Field('eventId', 'OpenEventId/id', integer),
+    Field('bonusType', 'BonusType', text),
+    Group('bonusValue', (
+        *id_str('partnerId', 'partnerName', 'PartnerId'),
+        *id_str('characterId', 'characterName', 'CharacterId'),
+        *id_str('musicId', 'musicName', 'MusicId'),
+        *id_str('titleId', 'titleName', 'TitleId'),
+        *id_str('plateId', 'plateName', 'PlateId'),
+        *id_str('iconId', 'iconName', 'IconId'),
+        *id_str('frameId', 'frameName', 'FrameId'),
+        *id_str('ticketId', 'ticketName', 'TicketId'),
+    )),
+    Group('bonusInfo', (
+        Field('maxPoint', 'maxPoint', integer),
+        Field('isRepeatGet', 'IsRepeatGet', boolean),
+        Field('isCollabo', 'IsCollabo', boolean),
+    )),
+)
+
+map_fields = (
+    *id_str('mapId', 'mapName', 'name'),
+    *id_str('islandId', 'islandName', 'IslandId'),
+    *id_str('colorId', 'colorName', 'ColorId'),
+    *id_str('bonusMusicId', 'bonusMusicName', 'BonusMusicId'),
+    Field('eventId', 'OpenEventId/id', integer),
+    Field('bonusMusicMagnification', 'BonusMusicMagnification', integer),
+    Group('mapInfo', (
+        Field('isCollabo', 'IsCollabo', boolean),
+        Field('isInfinity', 'IsInfinity', boolean),
+    )),
+    Items('mapDetail', 'TreasureExDatas/MapTreasureExData', (
+        Field('distance', 'Distance', integer),
+        Field('flag', 'Flag', text),
+        Field('subParam1', 'SubParam1', integer),
+        Field('subParam2', 'SubParam2', integer),
+        *id_str('treasureId', 'treasureName', 'TreasureId'),
+    )),
+)
+
+map_bonus_music_fields = (
+    *id_str('mapBonusId', 'mapBonusName', 'name'),
+    Items('musicList', 'MusicIds/list/StringID', id_str('musicId', 'musicName', '')),
+)
+
+map_color_fields = (
+    *id_str('mapColorId', 'mapColorName', 'name'),
+    *id_str('colorGroupId', 'colorGroupName', 'ColorGroupId'),
+    Field('color', 'Color', color),
+    Field('colorDark', 'ColorDark', color),
+)
+
+map_treasure_fields = (
+    *id_str('treasureId', 'treasureName', 'name'),
+    Field('treasureType', 'TreasureType', text),
+    Group('treasureDetail', (
+        *id_str('characterId', 'characterName', 'CharacterId'),
+        *id_str('musicId', 'musicName', 'MusicId'),
+        Field('numeric', 'Numeric', integer),
+        *id_str('namePlateId', 'namePlateName', 'NamePlate'),
+        *id_str('frameId', 'frameName', 'Frame'),
+        *id_str('titleId', 'titleName', 'Title'),
+        *id_str('iconId', 'iconName', 'Icon'),
+        *id_str('challengeId', 'challengeName', 'Challenge'),
+    )),
+)
+
+music_fields = (
+    *id_str('musicId', 'musicName', 'name'),
+    Field('sortName', 'sortName', text),
+    *id_str('artistId', 'artistName', 'artistName'),
+    *id_str('genreId', 'genreName', 'genreName'),
+    Field('bpm', 'bpm', number),
+    Field('version', 'version', text),
+    Group('info', (
+        Field('lockType', 'lockType', integer),
+        Field('subLockType', 'subLockType', integer),
+        *id_str('eventId', 'eventName', 'eventName'),
+    )),
+    Items('note', 'notesData/Notes', (
+        Field('level', '', level),
+        *id_str('designerId', 'designerName', 'notesDesigner'),
+        Field('noteType', 'notesType', integer),
+        Field('musicLevelId', 'musicLevelID', integer),
+        Field('isEnable', 'isEnable', boolean),
+        Field('volume', 'file/path', volume),
+        Field('chart', 'file/path', chart, 'analyze'),
+        Field('difficulty', '', list_index, 'charts'),
+    ), keep=has_level),
+)
+
+
+# 合并多个opt时附加的来源字段，只用于确定sqlite的列，不从xml中提取
+layer_fields = (
+    Field('opt', '', text),
+    Field('overrides', '', text),
+)
+
+
+# 分类表: 目录名, xml文件名, 输出的json名, 字段表
+# 新增分类时只需要写好字段表并加到这里
+categories = [
+    ('challenge', 'Challenge.xml', 'Challenge', challenge_fields),
+    ('chara', 'Chara.xml', 'Chara', chara_fields),
+    ('charaGenre', 'CharaGenre.xml', 'CharaGenre', chara_genre_fields),
+    ('collectionGenre', 'CollectionGenre.xml', 'CollectionGenre', collection_genre_fields),
+    ('course', 'Course.xml', 'Course', course_fields),
+    ('event', 'Event.xml', 'Event', event_fields),
+    ('frame', 'Frame.xml', 'Frame', frame_fields),
+    ('icon', 'Icon.xml', 'Icon', icon_fields),
+    ('loginBonus', 'LoginBonus.xml', 'LoginBonus', login_bonus_fields),
+    ('map', 'Map.xml', 'Map', map_fields),
+    ('mapBonusMusic', 'MapBonusMusic.xml', 'MapBonusMusic', map_bonus_music_fields),
+    ('mapColor', 'MapColor.xml', 'MapColor', map_color_fields),
+    ('mapTreasure', 'MapTreasure.xml', 'MapTreasure', map_treasure_fields),
+    ('music', 'Music.xml', 'Music', music_fields),
+]
+
+
+# 解析失败的文件：路径、异常类型、异常信息、出错的位置（文件:行号 in 函数）
+class ParseFailure(NamedTuple):
+    path: str
+    error: str
+    message: str
+    where: str
+
+
+def parse_isolated(parser, xmlfile, ctx=None):
+    # 单个文件出错时返回ParseFailure而不是中断整个分类
+    try:
+        return parser(xmlfile, ctx)
+    except Exception as error:
+        frame = traceback.extract_tb(error.__traceback__)[-1]
+        return ParseFailure(xmlfile, type(error).__name__, str(error),
+                            f'{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}')
+
+
+def parse_chunk(parser, xml_list, timed=False, isolate=False, files=None, io_concurrency=1):
+    # 在当前进程（或子进程）中依次解析一组文件；timed时同时返回每个文件的(路径, 耗时, 其中ma2的耗时)
+    # isolate时出错的文件返回ParseFailure；files为各条目依赖的文件时用io_concurrency个线程提前读取
+    if files is not None:
+        xml_list = prefetched(xml_list, files, io_concurrency)
+    if not timed:
+        if isolate:
+            return [parse_isolated(parser, xmlfile) for xmlfile in xml_list]
+        return [parser(xmlfile) for xmlfile in xml_list]
     dics = []
+    timings = []
     for xmlfile in xml_list:
-        # 获取文件的目录
-        ma2_dir = os.path.dirname(xmlfile)
-        # 读取文件
-        root = et.parse(xmlfile).getroot()
-        # 获取谱面信息
-        note_details = []
-        notes_data = root.find('notesData')
-        notes = notes_data.findall('Notes')
-        for note in notes:
-            if note.find('level').text != '0':
-                ma2_file = os.path.join(ma2_dir, note.find('file').find('path').text)
-                note_num = ma2_reader(ma2_file)
-                note_detail = {
-                    "level": int(note.find('level').text) + int(note.find('levelDecimal').text) / 10,
-                    "designerId": int(note.find('notesDesigner').find('id').text),
-                    "designerName": note.find('notesDesigner').find('str').text,
-                    "noteType": int(note.find('notesType').text),
-                    "musicLevelId": int(note.find('musicLevelID').text),
-                    "isEnable": str_to_bool[note.find('isEnable').text],
-                    "volume": {
-                        "tap": note_num[0] if note_num else 0,
-                        "break": note_num[1] if note_num else 0,
-                        "hold": note_num[2] if note_num else 0,
-                        "slide": note_num[3] if note_num else 0,
-                        "all": note_num[4] if note_num else 0
-                    }
-                }
-                note_details.append(note_detail)
-        # 构建字典
-        dic = {
-            "musicId": int(root.find('name').find('id').text),
-            "musicName": root.find('name').find('str').text,
-            "sortName": root.find('sortName').text,
-            "artistId": int(root.find('artistName').find('id').text),
-            "artistName": root.find('artistName').find('str').text,
-            "genreId": int(root.find('genreName').find('id').text),
-            "genreName": root.find('genreName').find('str').text,
-            "bpm": float(root.find('bpm').text),
-            "version": root.find('version').text,
-            "info": {
-                "lockType": int(root.find('lockType').text),
-                "subLockType": int(root.find('subLockType').text),
-                "eventId": int(root.find('eventName').find('id').text),
-                "eventName": root.find('eventName').find('str').text,
-            },
-            "note": note_details,
-        }
-        dics.append(dic)
-    await save_to_json('Music', dics)
+        ctx = {'ma2': 0.0}
+        start = time.perf_counter()
+        dics.append(parse_isolated(parser, xmlfile, ctx) if isolate else parser(xmlfile, ctx))
+        timings.append((xmlfile, time.perf_counter() - start, ctx['ma2']))
+    return dics, timings
+
+
+def split_chunks(items, jobs, costs=None, limit=None):
+    # 小分类整体作为一个任务，大分类（如music）按文件切分，每个进程大约分到4块
+    # 有内存上限时每块的估算内存还不超过上限的1/(jobs*2)，所有进程可以同时各处理两块
+    chunk_size = max(16, -(-len(items) // (jobs * 4)))
+    if limit is None:
+        return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    target = limit // (jobs * 2)
+    chunks = []
+    chunk = []
+    total = 0
+    for i in items:
+        if chunk and (len(chunk) >= chunk_size or total + costs[i] > target):
+            chunks.append(chunk)
+            chunk = []
+            total = 0
+        chunk.append(i)
+        total += costs[i]
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+class MemoryBudget:
+    # 正在解析以及等待写出的条目的估算内存之和不超过limit，超出时暂停提交新的块，直到前面的结果写出
+    # 当前没有占用时总是允许，单个超过上限的块也能处理
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self, size):
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.used or self.used + size <= self.limit)
+            self.used += size
+
+    async def release(self, size):
+        async with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+
+def entry_cost(deps):
+    # 条目解析时的估算内存：元素树与结果字典大约是文件大小（deps为entry_deps的结果）的几倍
+    return MEMORY_FACTOR * sum(st.st_size for _, st in deps)
+
+
+def open_writer(opt_name, output_format):
+    # 所有分类写入同一个文件的输出格式，其他格式每个分类一个文件，返回None
+    if output_format == 'sqlite':
+        return SqliteWriter(f'{opt_name}.db')
+    if output_format in compact.EXTENSIONS:
+        return compact.CompactWriter(f'{opt_name}.{compact.EXTENSIONS[output_format]}',
+                                     'gzip' if output_format == 'compact-bin' else 'json')
+    return None
+
+
+class Pipeline:
+    # 一次提取运行的设置以及共用的资源（进程池、缓存、数据库、统计）
+    # output_format为None时不写文件，各分类的结果按条目顺序保存在results中
+    # merge时条目来自多个opt，按各分类第一个字段（ID）合并后再输出；xref为CrossIndex时同时记录各条目的ID与引用
+    # isolate时出错的文件不中断运行，记录在failures中并从输出中略去
+    # max_memory为字节数时限制进程池中同时处理、等待写出的条目的估算内存
+    # io_concurrency大于1时每个进程用这么多线程提前读取后面条目的文件
+    def __init__(self, opt_name, jobs=1, manifest=None, output_format='json', metrics=None, profile=None,
+                 merge=False, xref=None, isolate=False, max_memory=None, io_concurrency=1, charts=None):
+        self.opt_name = opt_name
+        self.jobs = jobs
+        self.manifest = manifest
+        self.output_format = output_format
+        self.metrics = metrics
+        self.profile = profile
+        self.merge = merge
+        self.xref = xref
+        self.charts = charts
+        self.isolate = isolate
+        self.failures = []
+        self.max_memory = max_memory
+        self.io_concurrency = io_concurrency
+        self.budget = None
+        self.pool = None
+        self.database = None
+        self.results = {}
+
+    def iter_category(self, json_name, entries, parser, pool=None):
+        # 按条目顺序逐个产出(条目, 字典)；有缓存时先取出未变化的条目，只解析新增或修改过的条目
+        # 缓存、统计与内存额度用到的stat在这里一次完成，io_concurrency大于1时在线程池中进行
+        manifest = self.manifest
+        deps = None
+        if manifest is not None or self.metrics is not None or self.budget is not None:
+            deps = stat_entries(entries, self.io_concurrency)
+        if manifest is not None:
+            dics = [manifest.get(entry, files) for entry, files in zip(entries, deps)]
+        else:
+            dics = [None] * len(entries)
+        if self.metrics is not None:
+            category = self.metrics.category(json_name)
+            category['files'] += len(entries)
+            category['cached'] += sum(dic is not None for dic in dics)
+            category['bytes'] += sum(st.st_size for files in deps for _, st in files)
+        if pool is None:
+            return self.iter_serial(json_name, entries, parser, dics, deps)
+        # 分块立即交给进程池，而不是等到开始读取结果时才提交；有内存上限时由feed按上限逐块提交
+        todo = [i for i, dic in enumerate(dics) if dic is None]
+        futures = asyncio.Queue()
+        if self.budget is None:
+            chunks = split_chunks(todo, self.jobs)
+            costs = feed = None
+            for chunk in chunks:
+                futures.put_nowait(self.submit(pool, parser, entries, chunk))
+        else:
+            costs = {i: entry_cost(deps[i]) for i in todo}
+            chunks = split_chunks(todo, self.jobs, costs, self.max_memory)
+            costs = [sum(costs[i] for i in chunk) for chunk in chunks]
+            feed = functools.partial(self.feed, pool, parser, entries, chunks, costs, futures)
+        return self.iter_pool(json_name, entries, dics, deps, chunks, futures, costs, feed)
+
+    def submit(self, pool, parser, entries, chunk):
+        files = [entry_files(entries[i]) for i in chunk] if self.io_concurrency > 1 else None
+        return asyncio.get_running_loop().run_in_executor(
+            pool, parse_chunk, parser, [entries[i].xml for i in chunk], self.metrics is not None, self.isolate,
+            files, self.io_concurrency)
 
+    async def feed(self, pool, parser, entries, chunks, costs, futures):
+        # 同一分类的块按顺序取得额度，避免后面的块占住额度而前面的块一直等待
+        for chunk, cost in zip(chunks, costs):
+            await self.budget.acquire(cost)
+            futures.put_nowait(self.submit(pool, parser, entries, chunk))
 
-async def run_tasks(tasks):
-    # 用gather进行伪并发处理
-    await asyncio.gather(*tasks)
+    def record(self, json_name, entry, dic, deps):
+        # 记入缓存或日志；解析失败的条目只写入日志，返回None表示不输出
+        if isinstance(dic, ParseFailure):
+            self.failures.append(dict(dic._asdict(), category=json_name))
+            if isinstance(self.manifest, Journal):
+                self.manifest.put(entry, dic, deps)
+            return None
+        if self.manifest is not None:
+            self.manifest.put(entry, dic, deps)
+        return dic
+
+    async def iter_serial(self, json_name, entries, parser, dics, deps):
+        # 需要解析的条目按顺序预读，取出下一个时它的文件已经在内存中
+        todo = [entry for entry, dic in zip(entries, dics) if dic is None]
+        parsing = prefetched(todo, [entry_files(entry) for entry in todo], self.io_concurrency)
+        for i, (entry, dic) in enumerate(zip(entries, dics)):
+            if dic is None:
+                next(parsing)
+                if self.metrics is not None:
+                    (dic,), timings = parse_chunk(parser, [entry.xml], True, self.isolate)
+                    self.metrics.add_file(json_name, *timings[0])
+                elif self.isolate:
+                    dic = parse_isolated(parser, entry.xml)
+                else:
+                    dic = parser(entry.xml)
+                dic = self.record(json_name, entry, dic, deps and deps[i])
+                if dic is None:
+                    continue
+            yield entry, dic
+
+    async def iter_pool(self, json_name, entries, dics, deps, chunks, futures, costs=None, feed=None):
+        # 按条目顺序等待各块完成并立即产出，保证输出与串行一致；有内存上限时块的结果写出后归还额度
+        # 有内存上限时到开始读取结果才取得额度：sqlite等待写入锁的分类不占额度，持有锁的分类不会一直等待
+        feeder = asyncio.ensure_future(feed()) if feed is not None else None
+        done = 0
+        try:
+            for n, chunk in enumerate(chunks):
+                parsed = await (await futures.get())
+                if self.metrics is not None:
+                    parsed, timings = parsed
+                    for timing in timings:
+                        self.metrics.add_file(json_name, *timing)
+                for i, dic in zip(chunk, parsed):
+                    dics[i] = self.record(json_name, entries[i], dic, deps and deps[i])
+                for i in range(done, chunk[-1] + 1):
+                    if dics[i] is not None:
+                        yield entries[i], dics[i]
+                        dics[i] = None
+                done = chunk[-1] + 1
+                if costs is not None:
+                    await self.budget.release(costs[n])
+            for i in range(done, len(dics)):
+                yield entries[i], dics[i]
+        finally:
+            if feeder is not None:
+                feeder.cancel()
+
+    async def category_parse(self, entries, json_name, parser):
+        start = time.perf_counter()
+        profiler = None
+        if self.profile == json_name:
+            # 被分析的分类在本进程中串行执行，统计结果才完整
+            profiler = cProfile.Profile()
+            profiler.enable()
+        results = self.iter_category(json_name, entries, parser, None if profiler else self.pool)
+        fields, select = parser.fields, parser.select
+        if self.merge:
+            dics = merge_layers(results, fields[0].key)
+            fields = fields + layer_fields
+            select = select and dict(select, **{spec.key: None for spec in layer_fields})
+        else:
+            dics = (dic async for _, dic in results)
+        if self.xref is not None:
+            dics = self.xref.tap(json_name, parser.fields[0].key, dics)
+        if self.charts is not None and json_name == 'Music':
+            dics = self.charts.tap(dics)
+        if self.output_format is None:
+            self.results[json_name] = [dic async for dic in dics]
+        elif self.database is not None:
+            await self.database.save(json_name, fields, select, dics, self.metrics)
+        else:
+            await save_to_json(f'{self.opt_name}-{json_name}.{self.output_format}', dics, self.output_format,
+                               self.metrics)
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(f'{self.opt_name}-{json_name}.prof')
+            print(f'Profile of {json_name} saved to {self.opt_name}-{json_name}.prof')
+        if self.metrics is not None:
+            self.metrics.category(json_name)['seconds'] += time.perf_counter() - start
+
+    async def run(self, tasks):
+        # sqlite和紧凑格式时所有分类写入同一个文件
+        self.database = open_writer(self.opt_name, self.output_format)
+        try:
+            # 被分析的分类先单独执行，避免其他分类混入统计结果
+            for task in tasks:
+                if task[1] == self.profile:
+                    await self.category_parse(*task)
+            tasks = [task for task in tasks if task[1] != self.profile]
+            if self.jobs <= 1:
+                # 单进程时按原来的方式依次执行
+                await asyncio.gather(*(self.category_parse(*task) for task in tasks))
+                return
+            # 多进程时各分类共用一个进程池
+            if self.max_memory is not None:
+                self.budget = MemoryBudget(self.max_memory)
+            with ProcessPoolExecutor(max_workers=self.jobs) as self.pool:
+                await asyncio.gather(*(self.category_parse(*task) for task in tasks))
+        finally:
+            self.pool = None
+            self.budget = None
+            if self.database is not None:
+                self.database.close()
 
 
 if __name__ == '__main__':
-    # 检测传入的路径是否合理
-    try:
-        file_root = sys.argv[1]
-        opt_name = os.path.basename(os.path.dirname(file_root))
+    arg_parser = argparse.ArgumentParser(description='Quick extraction of information in the opt resource package.')
+    arg_parser.add_argument('path', nargs='*',
+                            help='the OPT FOLDER PATH, e.g. A000/, or a zip/tar archive of it '
+                                 '(A000.zip, or A000.zip::A000 for a folder inside); several with --merge')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='number of worker processes, 0 means one per CPU (default: 1)')
+    arg_parser.add_argument('--skip', action='append', metavar='PATTERN',
+                            help='entry directory name (wildcards allowed) to skip, can be repeated '
+                                 '(default: music000000 and music000001)')
+    arg_parser.add_argument('--cache', metavar='FILE',
+                            help='manifest file for incremental extraction, unchanged entries are taken from it')
+    arg_parser.add_argument('--journal', metavar='FILE',
+                            help='record every finished entry in FILE as the run goes; files that fail to parse are '
+                                 'quarantined to {opt}-quarantine.json instead of aborting the run, and running again '
+                                 'with the same FILE only parses failed, changed or unfinished entries')
+    arg_parser.add_argument('--max-memory', type=int, metavar='MB',
+                            help='keep the estimated memory of entries being parsed or waiting to be written under MB; '
+                                 'workers pause until earlier results are written, and unused parts of each xml '
+                                 'are dropped while it is read')
+    arg_parser.add_argument('--io-concurrency', type=int, default=1, metavar='N',
+                            help='read the files of upcoming entries with N threads per process while parsing, '
+                                 'and scan categories in parallel; helps on network storage (default: 1, no read-ahead)')
+    arg_parser.add_argument('--hash', action='store_true',
+                            help='also record content hashes in the manifest, so touched but unchanged files stay cached')
+    arg_parser.add_argument('--analyze', action='store_true',
+                            help='parse every chart and add length, note density and a notes-per-second curve to Music')
+    arg_parser.add_argument('--format', choices=('json', 'ndjson', 'sqlite', 'compact', 'compact-bin'), default='json',
+                            help='json writes one indented array per category, '
+                                 'ndjson writes one compact entry per line, '
+                                 'sqlite writes every category into indexed tables of {opt}.db, '
+                                 'compact writes every category into {opt}.compact.json with a shared string table '
+                                 '(read it back with compact.load), compact-bin is the same document gzip-compressed '
+                                 'as {opt}.compact.json.gz (default: json)')
+    arg_parser.add_argument('--metrics', metavar='FILE',
+                            help='write phase timings, per-category counts and the slowest files to a JSON file')
+    arg_parser.add_argument('--metrics-top', type=int, default=20, metavar='N',
+                            help='number of slowest files kept in the metrics (default: 20)')
+    arg_parser.add_argument('--profile', metavar='CATEGORY',
+                            help='run one category (e.g. Music) in-process under cProfile and dump {opt}-CATEGORY.prof')
+    arg_parser.add_argument('--merge', metavar='NAME',
+                            help='merge several OPT folders into one dataset written as NAME-*.json; '
+                                 'folders are layered in name order and later ones override entries with the same ID')
+    arg_parser.add_argument('--xref', metavar='FILE',
+                            help='write a cross-reference index (IDs, reverse references, dangling references) '
+                                 'to a JSON file')
+    arg_parser.add_argument('--assets', metavar='FILE',
+                            help='write a manifest of the sound, jacket, movie and other asset files with their SHA-1 '
+                                 'and the music/chara/frame/icon IDs they belong to; files whose size and mtime '
+                                 'match the previous FILE are not hashed again')
+    arg_parser.add_argument('--charts', metavar='FILE',
+                            help='also write one row per chart (musicId, difficulty, level, designerId, bpm, note '
+                                 'counts, and length and density with --analyze) to a columnar binary file; '
+                                 'query it with charts.py')
+    arg_parser.add_argument('--watch', action='store_true',
+                            help='keep running after the first extraction, poll the OPT folder and update the outputs '
+                                 'of categories whose entries changed')
+    arg_parser.add_argument('--interval', type=float, default=0.5, metavar='SECONDS',
+                            help='polling interval of --watch (default: 0.5)')
+    arg_parser.add_argument('--fields', metavar='LIST',
+                            help='only output these fields, e.g. music.bpm,music.note.level; '
+                                 'categories not listed are output in full')
+    args = arg_parser.parse_args()
 
-        print('---')
-        print('Got the OPT FOLDER PATH: ' + file_root)
-    except IndexError as e:
+    # 检测传入的路径是否合理
+    if not args.path:
         print('You need to send the OPT FOLDER PATH with this script!')
         sys.exit()
+    if len(args.path) > 1 and not args.merge:
+        arg_parser.error('several OPT folders can only be extracted together with --merge NAME')
+    if args.journal and args.cache:
+        arg_parser.error('--journal and --cache cannot be used together')
+    if args.watch:
+        # 监视模式只更新各分类的输出，这些选项的文件不会生成
+        unsupported = [option for option, value in (
+            ('--xref', args.xref), ('--charts', args.charts), ('--assets', args.assets), ('--metrics', args.metrics),
+            ('--cache', args.cache), ('--journal', args.journal), ('--profile', args.profile)) if value]
+        if unsupported:
+            arg_parser.error(f'{", ".join(unsupported)} cannot be used with --watch')
+    selects = parse_fields(args.fields) if args.fields else {}
+    unknown = unknown_fields({dir_name: fields for dir_name, _, _, fields in categories}, selects)
+    if unknown:
+        arg_parser.error(f'unknown fields in --fields: {", ".join(unknown)}')
+    # 压缩包在这里读取一次成员索引，无法按成员读取时直接退出
+    try:
+        opt_names = [opt_name_of(root) for root in args.path]
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
+    if args.merge:
+        opt_name = args.merge
+    elif is_archive(args.path[0]):
+        opt_name = opt_names[0]
+    else:
+        opt_name = os.path.basename(os.path.dirname(args.path[0]))
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
 
-    # 传入路径后检测是否包含指定的文件夹，如包含则在运行列表中加入对应的抽取函数
-    task_list = []
-
-    if os.path.exists(f'{file_root}/challenge'):
-        print('Find challenge dir!')
-        task_list.append(challenge_parse(f'{file_root}/challenge'))
-    if os.path.exists(f'{file_root}/chara'):
-        print('Find chara dir!')
-        task_list.append(chara_parse(f'{file_root}/chara'))
-    if os.path.exists(f'{file_root}/charaGenre'):
-        print('Find chareGenre dir!')
-        task_list.append(chara_genre_parse(f'{file_root}/charaGenre'))
-    if os.path.exists(f'{file_root}/collectionGenre'):
-        print('Find collectionGenre dir!')
-        task_list.append(collection_genre_parse(f'{file_root}/collectionGenre'))
-    if os.path.exists(f'{file_root}/course'):
-        print('Find course dir!')
-        task_list.append(course_parse(f'{file_root}/course'))
-    if os.path.exists(f'{file_root}/event'):
-        print('Find event dir!')
-        task_list.append(event_parse(f'{file_root}/event'))
-    if os.path.exists(f'{file_root}/frame'):
-        print('Find frame dir!')
-        task_list.append(frame_parse(f'{file_root}/frame'))
-    if os.path.exists(f'{file_root}/icon'):
-        print('Find icon dir!')
-        task_list.append(icon_parse(f'{file_root}/icon'))
-    if os.path.exists(f'{file_root}/loginBonus'):
-        print('Find loginBonus dir!')
-        task_list.append(login_bonus_parse(f'{file_root}/loginBonus'))
-    if os.path.exists(f'{file_root}/map'):
-        print('Find map dir!')
-        task_list.append(map_parse(f'{file_root}/map'))
-    if os.path.exists(f'{file_root}/mapBonusMusic'):
-        print('Find mapBonusMusic dir!')
-        task_list.append(map_bonus_music_parse(f'{file_root}/mapBonusMusic'))
-    if os.path.exists(f'{file_root}/mapColor'):
-        print('Find mapColor dir!')
-        task_list.append(map_color_parse(f'{file_root}/mapColor'))
-    if os.path.exists(f'{file_root}/mapTreasure'):
-        print('Find mapTreasure dir!')
-        task_list.append(map_treasure_parse(f'{file_root}/mapTreasure'))
-    if os.path.exists(f'{file_root}/music'):
-        print('Find music dir!')
-        task_list.append(music_parse(f'{file_root}/music'))
+    print('---')
+    for file_root in args.path:
+        print('Got the OPT FOLDER PATH: ' + file_root)
 
     # 获取当前的时间（开始时间）
     start_time = time.time()
 
-    # 使用asyncio来进行异步并发执行，提升脚本的处理效率
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(run_tasks(task_list))
+    # 一次扫描opt目录建立索引，包含指定的分类文件夹时在运行列表中加入对应的抽取任务
+    metrics = Metrics(args.metrics_top) if args.metrics else None
+    scan_start = time.perf_counter()
+    skip = tuple(args.skip) if args.skip else default_skip
+    io_concurrency = max(1, args.io_concurrency)
+    if args.merge:
+        index = scan_layers(args.path, skip, io_concurrency)
+    else:
+        index = scan_opt(args.path[0], skip, io_concurrency)
+    if metrics is not None:
+        metrics.add('scan', time.perf_counter() - scan_start)
+    task_list = []
+    parsers = {}
+    for dir_name, file_name, json_name, fields in categories:
+        # 字段表只编译一次，得到该分类的提取函数；合并、建立索引或写入sqlite（子表以ID关联父表）时必须提取ID
+        # 交叉引用索引还需要该分类的所有引用字段，否则没有选择的引用会从索引中消失
+        select = selects.get(dir_name)
+        if (args.merge or args.xref or args.assets or args.format == 'sqlite') and select is not None:
+            select[fields[0].key] = None
+        if args.xref and select is not None:
+            for category, path, _ in REFERENCES:
+                if category == json_name:
+                    add_select(select, path.split('.'))
+        # 谱面表同样需要它用到的字段，difficulty（谱面在xml中的原始位置）只为谱面表提取
+        if args.charts and json_name == 'Music' and select is not None:
+            for path in CHART_FIELDS:
+                add_select(select, path.split('.'))
+        parsers[dir_name] = (json_name, Extractor(fields, select, {'analyze': args.analyze, 'charts': bool(args.charts),
+                                                                   'stream': args.max_memory is not None}))
+        if dir_name in index:
+            print(f'Find {dir_name} dir!')
+            task_list.append((index[dir_name], json_name, parsers[dir_name][1]))
+
+    if args.watch:
+        # 监视模式一直运行到Ctrl+C，结果保存在内存中，不使用缓存清单
+        from watch import Watcher
+        Watcher(args.path, opt_name, parsers, jobs, args.format, skip, bool(args.merge), args.interval).run()
+        sys.exit()
+
+    # 使用asyncio调度各分类，jobs大于1时解析工作分发到多个进程
+    # 记录实际提取的字段（包括上面强制提取的ID与引用字段），而不是命令行中的原文
+    config = {'analyze': args.analyze, 'fields': selects or None}
+    if args.merge:
+        config['merge'] = True
+    if args.charts:
+        config['charts'] = True
+    manifest = Manifest(args.cache, args.hash, config) if args.cache else None
+    journal = Journal(args.journal, config) if args.journal else None
+    # 资源清单按各分类的ID关联资源，同样由索引记录ID
+    xref = CrossIndex() if args.xref or args.assets else None
+    chart_table = ChartTable() if args.charts else None
+    max_memory = args.max_memory * 1024 * 1024 if args.max_memory is not None else None
+    pipeline = Pipeline(opt_name, jobs, manifest or journal, args.format, metrics, args.profile, bool(args.merge),
+                        xref, journal is not None, max_memory, io_concurrency, chart_table)
+    try:
+        asyncio.run(pipeline.run(task_list))
+    except BaseException:
+        # 中断或崩溃时不压缩日志，还没有访问到的分类中已完成的条目同样保留
+        if journal is not None:
+            journal.close(compact=False)
+        raise
+    if journal is not None:
+        journal.close()
+        print(f'Resumed {journal.hits} entries from the journal.')
+        # 出错的文件及原因写入隔离报告，修复后再次运行只解析这些文件
+        quarantine = f'{opt_name}-quarantine.json'
+        if pipeline.failures:
+            with open(quarantine, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(pipeline.failures, indent=4, ensure_ascii=False))
+            print(f'{len(pipeline.failures)} files failed to parse, see {quarantine}')
+        elif os.path.exists(quarantine):
+            os.remove(quarantine)
+    if args.xref:
+        xref.resolve().save(args.xref)
+        print(f'Cross-reference index saved to {args.xref}, {len(xref.dangling)} dangling references.')
+    if chart_table is not None:
+        chart_table.save(args.charts)
+        print(f'Chart statistics of {len(chart_table)} charts saved to {args.charts}')
+    if args.assets:
+        # 复用扫描得到的索引，合并时每个opt只取自己的条目
+        layers = [(root, {dir_name: [entry for entry in entries if not args.merge or entry.opt == name]
+                          for dir_name, entries in index.items()})
+                  for root, name in sorted(zip(args.path, opt_names), key=lambda item: item[1])]
+        previous = load_manifest(args.assets)
+        assets, hashed = build_manifest([root for root, _ in layers], [layer for _, layer in layers],
+                                        {dir_name: json_name for dir_name, _, json_name, _ in categories}, xref.ids,
+                                        previous, max(jobs, io_concurrency), skip)
+        added, changed, removed = manifest_changes(previous, assets)
+        save_manifest(args.assets, assets, added, changed, removed)
+        print(f'Asset manifest saved to {args.assets}: {len(assets)} assets, {hashed} hashed, '
+              f'{len(added)} added, {len(changed)} changed, {len(removed)} removed.')
+    if manifest is not None:
+        manifest.save()
+        print(f'Reused {manifest.hits} cached entries.')
 
     # 获取当前的时间（结束时间）
     end_time = time.time()
 
     # 计算并输出总的执行时间
     total_time = end_time - start_time
+    if metrics is not None:
+        metrics.save(args.metrics, total_time)
+        print(f'Metrics saved to {args.metrics}')
     print(f'Total time spent: {total_time} s\n===')
@@ -0,0 +1,73 @@
+# 预读：在线程池中提前读取后面条目要用到的文件，解析当前条目的同时等待其他文件的读取
+# Read-ahead for high-latency storage: the files of upcoming entries are read by a bounded thread pool while the
+# current entry is parsed. Parsers pick the contents up through archive.open_file, so they need no changes.
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import archive
+from archive import open_file
+
+
+def read_files(paths):
+    # 读取一组文件，不存在的文件不预读，解析时会像原来一样抛出FileNotFoundError
+    files = {}
+    for path in paths:
+        try:
+            with open_file(path) as f:
+                files[path] = f.read()
+        except FileNotFoundError:
+            pass
+    return files
+
+
+@contextmanager
+def preload(files):
+    # 解析期间open_file直接返回预读的内容
+    archive.preloaded.update(files)
+    try:
+        yield
+    finally:
+        for path in files:
+            archive.preloaded.pop(path, None)
+
+
+def prefetched(items, groups, concurrency):
+    # 按顺序产出items，产出某一项时它对应的那组文件已经读入内存；concurrency不大于1时不预读
+    if concurrency <= 1:
+        yield from items
+        return
+    with Prefetcher(concurrency) as prefetcher:
+        for item, files in zip(items, prefetcher.iter(groups)):
+            with preload(files):
+                yield item
+
+
+class Prefetcher:
+    # concurrency为同时进行的读取数；最多提前读取concurrency*2组，已读取但还没解析的文件不会无限增加
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def iter(self, groups):
+        # 按顺序产出每组文件的内容（路径 -> bytes）
+        window = deque()
+        groups = iter(groups)
+        for paths in groups:
+            window.append(self.executor.submit(read_files, paths))
+            if len(window) >= self.concurrency * 2:
+                break
+        for paths in groups:
+            yield window.popleft().result()
+            window.append(self.executor.submit(read_files, paths))
+        while window:
+            yield window.popleft().result()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
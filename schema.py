@@ -0,0 +1,228 @@
+# 声明式的字段定义，以及把字段表编译成提取函数的引擎
+# Declarative field specs for the OPT categories and the engine that compiles them into extractors.
+import os.path
+import xml.etree.ElementTree as et
+from typing import Callable, NamedTuple
+
+from archive import open_file
+
+
+# 普通字段：输出键、相对于当前元素的xml路径（''表示元素本身）、转换函数
+# 转换函数接收(元素, 上下文)；option不为空时只在对应选项打开时输出
+class Field(NamedTuple):
+    key: str
+    path: str
+    convert: Callable
+    option: str = None
+
+
+# 嵌套对象：输出键、子字段
+class Group(NamedTuple):
+    key: str
+    fields: tuple
+
+
+# 对象列表：路径最后一级的每个匹配元素生成一个对象
+# keep用于过滤列表元素；when为(路径, 文本)，只有该路径的文本相同时才输出列表，否则为空列表
+class Items(NamedTuple):
+    key: str
+    path: str
+    fields: tuple
+    keep: Callable = None
+    when: tuple = None
+
+
+def parse_fields(fields):
+    # 'music.bpm,music.note.level' -> {'music': {'bpm': None, 'note': {'level': None}}}，None表示全部输出
+    selects = {}
+    for item in fields.split(','):
+        keys = [key for key in item.strip().split('.') if key]
+        if keys:
+            add_select(selects, keys)
+    return selects
+
+
+def add_select(select, keys):
+    # 把一个字段路径加入选择，路径上的对象已经全部输出时不变
+    node = select
+    for key in keys[:-1]:
+        if node.get(key, {}) is None:
+            return
+        node = node.setdefault(key, {})
+    node[keys[-1]] = None
+
+
+def unknown_fields(tables, selects):
+    # 选择中在字段表里找不到的名称（如'music.bogus'），tables为 分类目录名 -> 字段表
+    unknown = []
+    for name, select in selects.items():
+        if name not in tables:
+            unknown.append(name)
+        elif select is not None:
+            unknown += unknown_keys(tables[name], select, f'{name}.')
+    return unknown
+
+
+def unknown_keys(fields, select, prefix):
+    specs = {spec.key: spec for spec in fields}
+    unknown = []
+    for key, sub in select.items():
+        spec = specs.get(key)
+        if spec is None:
+            unknown.append(prefix + key)
+        elif sub is not None:
+            # 普通字段整体输出，不能再选择其中的一部分
+            if isinstance(spec, Field):
+                unknown += [f'{prefix}{key}.{name}' for name in sub]
+            else:
+                unknown += unknown_keys(spec.fields, sub, f'{prefix}{key}.')
+    return unknown
+
+
+def add_path(trie, path, is_list=False):
+    # 把路径加入前缀树：标签 -> [完整路径, 是否列表, 子节点, 是否被字段直接使用]
+    node = trie
+    parts = path.split('/')
+    for i, tag in enumerate(parts):
+        item = node.get(tag)
+        if item is None:
+            item = node[tag] = ['/'.join(parts[:i + 1]), False, {}, False]
+        node = item[2]
+    item[1] = is_list
+    item[3] = True
+
+
+def collect(elem, trie, found):
+    # 只遍历一次每个需要的元素的子元素，按路径记下找到的元素（与find一样取第一个）
+    for child in elem:
+        item = trie.get(child.tag)
+        if item is None:
+            continue
+        path, is_list, sub, _ = item
+        if is_list:
+            found[path].append(child)
+        elif path not in found:
+            found[path] = child
+            if sub:
+                collect(child, sub, found)
+
+
+def compile_fields(fields, select, options, trie, lists):
+    # 把字段表编译成操作序列，需要的路径加入trie；返回根据找到的元素构建字典的函数
+    ops = []
+    for spec in fields:
+        if select is not None and spec.key not in select:
+            continue
+        sub_select = select[spec.key] if select is not None else None
+        if isinstance(spec, Field):
+            if spec.option and not options.get(spec.option):
+                continue
+            if spec.path:
+                add_path(trie, spec.path)
+            ops.append((spec.key, spec.path, spec.convert, None))
+        elif isinstance(spec, Group):
+            ops.append((spec.key, None, None, compile_fields(spec.fields, sub_select, options, trie, lists)))
+        else:
+            add_path(trie, spec.path, True)
+            lists.append(spec.path)
+            if spec.when:
+                add_path(trie, spec.when[0])
+            ops.append((spec.key, None, None, compile_items(spec, sub_select, options)))
+
+    def build(found, ctx):
+        dic = {}
+        for key, path, convert, sub in ops:
+            if sub is None:
+                dic[key] = convert(found[path], ctx)
+            else:
+                dic[key] = sub(found, ctx)
+        return dic
+    return build
+
+
+def compile_items(spec, select, options):
+    trie = {}
+    lists = []
+    build = compile_fields(spec.fields, select, options, trie, lists)
+    keep = spec.keep
+    when = spec.when
+
+    def build_items(found, ctx):
+        if when is not None:
+            elem = found.get(when[0])
+            if elem is None or elem.text != when[1]:
+                return []
+        items = []
+        for index, elem in enumerate(found[spec.path]):
+            if keep is not None and not keep(elem):
+                continue
+            # 元素在xml中的原始位置，keep过滤掉的元素也计算在内
+            ctx['index'] = index
+            items.append(build(extract_found(elem, trie, lists), ctx))
+        return items
+    return build_items
+
+
+class Found(dict):
+    # 没找到的路径返回None，转换函数会和原来的.find()链一样在取.text时出错
+    __slots__ = ()
+
+    def __missing__(self, path):
+        return None
+
+
+def extract_found(elem, trie, lists):
+    found = Found((path, []) for path in lists)
+    found[''] = elem
+    collect(elem, trie, found)
+    return found
+
+
+class Extractor:
+    # 由字段表编译得到的提取函数：extractor(xml文件) -> dict，每个xml只遍历一次
+    def __init__(self, fields, select=None, options=None):
+        self.fields = fields
+        self.select = select
+        self.options = options or {}
+        self.trie = {}
+        self.lists = []
+        self.build = compile_fields(fields, select, self.options, self.trie, self.lists)
+
+    def __call__(self, xmlfile, ctx=None):
+        # ctx为转换函数共用的上下文，转换函数可以在其中记录统计信息
+        # 选项stream打开时边读取边丢弃用不到的子树，内存更少但速度较慢
+        ctx = {'ma2': 0.0} if ctx is None else ctx
+        ctx['dir'] = os.path.dirname(xmlfile)
+        with open_file(xmlfile) as f:
+            root = parse_pruned(f, self.trie) if self.options.get('stream') else et.parse(f).getroot()
+        return self.build(extract_found(root, self.trie, self.lists), ctx)
+
+    def __reduce__(self):
+        # 编译结果是闭包，传给子进程时只传字段表，在子进程中重新编译
+        return Extractor, (self.fields, self.select, self.options)
+
+
+def parse_pruned(f, trie):
+    # 边读取边丢弃字段表用不到的子树，解析大文件时不保留整个元素树
+    # 状态：前缀树的一层（继续按标签筛选）、None（字段直接使用的元素，保留整个子树）、False（不需要）
+    root = None
+    states = []
+    for event, elem in et.iterparse(f, ('start', 'end')):
+        if event == 'start':
+            state = states[-1] if states else trie
+            if not states:
+                root = elem
+            elif state:
+                item = state.get(elem.tag)
+                if item is None:
+                    state = False
+                elif item[1] or item[3] or not item[2]:
+                    state = None
+                else:
+                    state = item[2]
+            elif state is not None:
+                state = False
+            states.append(state)
+        elif states.pop() is False and states[-1] is not False:
+            elem.clear()
+    return root
@@ -0,0 +1,192 @@
+# 把各分类的提取结果写入SQLite数据库
+# SQLite export: every category becomes a table, list fields become child tables, *Id columns get indexes.
+import asyncio
+import json
+import os.path
+import re
+import sqlite3
+import time
+
+from schema import Group, Items
+
+# 子表的名称，没有列出的子表命名为 父表_字段名
+CHILD_TABLES = {
+    ('Music', 'note'): 'chart',
+    ('Course', 'courseMusic'): 'course_music',
+    ('Map', 'mapDetail'): 'map_detail',
+    ('Challenge', 'relaxData'): 'challenge_relax',
+    ('MapBonusMusic', 'musicList'): 'map_bonus_music_list',
+}
+# 每张表攒够这么多行后批量插入一次
+BATCH_SIZE = 1000
+
+
+def snake_case(name):
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', name).lower()
+
+
+def column_type(value):
+    if isinstance(value, (bool, int)):
+        return 'INTEGER'
+    if isinstance(value, float):
+        return 'REAL'
+    if isinstance(value, str):
+        return 'TEXT'
+    return ''
+
+
+def scalar(value):
+    # 列表等无法展开的值以JSON文本保存
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def flatten(dic, fields, row, children, prefix=''):
+    # 按字段表展开一个条目：Group直接并入本表（重名时加上组名），值为字典的字段展开为 字段名_子键，
+    # Items交给子表；值为None的列不写入，插入时自然为NULL
+    for spec in fields:
+        value = dic.get(spec.key)
+        if value is None:
+            continue
+        if isinstance(spec, Group):
+            flatten(value, spec.fields, row, children, f'{spec.key}_')
+        elif isinstance(spec, Items):
+            children.append((spec, value))
+        elif isinstance(value, dict):
+            for key, sub in value.items():
+                row[f'{spec.key}_{key}'] = scalar(sub)
+        else:
+            row[prefix + spec.key if spec.key in row else spec.key] = scalar(value)
+    return row
+
+
+def spec_columns(fields, select, columns, prefix=''):
+    # 没有数据时仅按字段表（以及--fields的选择）建表
+    for spec in fields:
+        if select is not None and spec.key not in select:
+            continue
+        if isinstance(spec, Group):
+            spec_columns(spec.fields, select and select[spec.key], columns, f'{spec.key}_')
+        elif not isinstance(spec, Items):
+            columns.append(prefix + spec.key if spec.key in columns else spec.key)
+    return columns
+
+
+class Table:
+    # 一张表：第一行数据决定列，之后出现的新列用ALTER TABLE补上
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.columns = []
+        self.known = set()
+        self.created = False
+        self.rows = []
+        self.sql = None
+
+    def add_columns(self, row):
+        new = [column for column in row if column not in self.known]
+        if not new:
+            return
+        self.flush()
+        if not self.created:
+            definitions = ', '.join(f'"{column}" {column_type(row[column])}'.rstrip() for column in new)
+            self.db.execute(f'CREATE TABLE "{self.name}" ({definitions})')
+            self.created = True
+        else:
+            for column in new:
+                self.db.execute(f'ALTER TABLE "{self.name}" ADD COLUMN "{column}" {column_type(row[column])}'.rstrip())
+        self.columns += new
+        self.known.update(new)
+        names = ', '.join(f'"{column}"' for column in self.columns)
+        self.sql = f'INSERT INTO "{self.name}" ({names}) VALUES ({", ".join("?" * len(self.columns))})'
+
+    def insert(self, row):
+        if not self.known.issuperset(row):
+            self.add_columns(row)
+        self.rows.append(tuple(row.get(column) for column in self.columns))
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.db.executemany(self.sql, self.rows)
+            self.rows = []
+
+    def finish(self, columns):
+        # 写完后补建没有数据的空表，并给所有*Id列建立索引
+        self.flush()
+        if not self.created:
+            self.add_columns({column: None for column in columns})
+        for column in self.columns:
+            if column.endswith('Id'):
+                self.db.execute(f'CREATE INDEX "{self.name}_{column}" ON "{self.name}" ("{column}")')
+
+
+class SqliteWriter:
+    def __init__(self, path):
+        # 与json输出一样，已有的文件直接覆盖
+        if os.path.exists(path):
+            os.remove(path)
+        # 自己控制事务，建表和插入都放在同一个事务里
+        self.db = sqlite3.connect(path, isolation_level=None)
+        # 同一时间只有一个分类在写入，其余分类的解析仍在进程池中继续
+        self.lock = asyncio.Lock()
+
+    def insert(self, tables, names, name, fields, dic, parent=None):
+        children = []
+        row = dict(parent) if parent else {}
+        flatten(dic, fields, row, children)
+        tables[name].insert(row)
+        if not children:
+            return
+        # 子表带上父表的第一列（分类ID）和在列表中的位置；父表没有列时只有位置，与table_layout一致
+        child_parent = {'idx': 0}
+        if row:
+            first = next(iter(row))
+            child_parent = {first: row[first], 'idx': 0}
+        for spec, items in children:
+            for i, item in enumerate(items):
+                child_parent['idx'] = i
+                self.insert(tables, names, names[(name, spec.key)], spec.fields, item, child_parent)
+
+    def table_layout(self, table, json_name, fields, select, columns, names, parent=()):
+        # 预先确定所有表名及其由字段表决定的列
+        columns[table] = list(parent) + spec_columns(fields, select, [])
+        for spec in fields:
+            if isinstance(spec, Items) and (select is None or spec.key in select):
+                child = CHILD_TABLES.get((json_name, spec.key), f'{table}_{snake_case(spec.key)}')
+                names[(table, spec.key)] = child
+                parent_key = (columns[table][0], 'idx') if columns[table] else ('idx',)
+                self.table_layout(child, spec.key, spec.fields, select and select[spec.key], columns, names,
+                                  parent_key)
+        return columns
+
+    async def save(self, json_name, fields, select, dics, metrics=None):
+        table = snake_case(json_name)
+        names = {}
+        columns = self.table_layout(table, json_name, fields, select, {}, names)
+        tables = {name: Table(self.db, name) for name in columns}
+        async with self.lock:
+            # 每个分类一个事务
+            self.db.execute('BEGIN')
+            try:
+                for name in columns:
+                    self.db.execute(f'DROP TABLE IF EXISTS "{name}"')
+                write = 0.0
+                async for dic in dics:
+                    start = time.perf_counter()
+                    self.insert(tables, names, table, fields, dic)
+                    write += time.perf_counter() - start
+                start = time.perf_counter()
+                for name, table_columns in columns.items():
+                    tables[name].finish(table_columns)
+                if metrics is not None:
+                    metrics.add('write', write + time.perf_counter() - start)
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,168 @@
+# 生成用于测试与性能测试的opt资源包：结构由parse.py中的字段表推导，谱面带有完整的统计段
+# Synthetic OPT tree generator. The XML layout is derived from the field tables in parse.py,
+# so every category the extractor understands is covered, and Music.xml comes with matching .ma2 charts.
+import argparse
+import os.path
+import random
+import xml.etree.ElementTree as et
+
+import parse
+from schema import Field, Group
+
+# 所有分类的ID从这里开始编号，其他字段中的*Id在同样的范围内随机取值，大部分引用都能对上
+FIRST_ID = 100
+# Items.when不满足时写入的文本
+OTHER_TEXT = {'false': 'true', 'true': 'false'}
+NAMES = ('Alpha', 'ベータ', '伽马', 'Delta', 'イプシロン', '泽塔')
+
+
+def write_chart(path, notes):
+    # 生成一个结构完整的谱面，末尾带有统计段
+    lines = ['VERSION\t0.00.00\t1.04.00', 'FES_MODE\t0', 'BPM_DEF\t150.000\t150.000\t150.000\t150.000',
+             'MET_DEF\t4\t4', 'RESOLUTION\t384', 'CLK_DEF\t384', 'COMPATIBLE_CODE\tMA2', '',
+             'BPM\t0\t0\t150.000', 'MET\t0\t0\t4\t4', '']
+    counts = {'TAP': 0, 'BRK': 0, 'HLD': 0, 'SLD': 0}
+    for i in range(notes):
+        measure, tick, lane = 1 + i // 8, (i % 8) * 48, random.randint(0, 7)
+        kind = random.choice(('TAP', 'TAP', 'TAP', 'BRK', 'HLD', 'SLD'))
+        counts[kind] += 1
+        if kind == 'TAP':
+            lines.append(f'NMTAP\t{measure}\t{tick}\t{lane}')
+        elif kind == 'BRK':
+            lines.append(f'BRTAP\t{measure}\t{tick}\t{lane}')
+        elif kind == 'HLD':
+            lines.append(f'NMHLD\t{measure}\t{tick}\t{lane}\t96')
+        else:
+            lines.append(f'NMSI_\t{measure}\t{tick}\t{lane}\t96\t192\t{(lane + 4) % 8}')
+    total = sum(counts.values())
+    lines.append('')
+    for key in ('TAP', 'BRK', 'XTP', 'HLD', 'XHO', 'STR', 'BST', 'XST', 'TTP', 'THO', 'SLD'):
+        lines.append(f'T_REC_{key}\t{counts.get(key, 0)}')
+    for key in ('TAP', 'BRK', 'HLD', 'SLD'):
+        lines.append(f'T_NUM_{key}\t{counts[key]}')
+    lines.append(f'T_NUM_ALL\t{total}')
+    for key in ('TAP', 'HLD', 'SLD'):
+        lines.append(f'T_JUDGE_{key}\t{counts[key]}')
+    lines.append(f'T_JUDGE_ALL\t{total}')
+    lines += ['TTM_EACHPAIRS\t0', f'TTM_SCR_TAP\t{total * 500}', 'TTM_SCR_S\t970000', 'TTM_RAT_ACV\t10000']
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def node_at(elem, path):
+    # 按路径找到（没有时创建）对应的元素
+    for tag in path.split('/') if path else ():
+        child = elem.find(tag)
+        elem = child if child is not None else et.SubElement(elem, tag)
+    return elem
+
+
+def gen_integer(elem, spec, ctx):
+    if spec.path == 'name/id':
+        elem.text = str(ctx['id'])
+    elif spec.key.endswith('Id'):
+        elem.text = str(random.randrange(FIRST_ID, FIRST_ID + ctx['count']))
+    else:
+        elem.text = str(random.randint(0, 100))
+
+
+def gen_text(elem, spec, ctx):
+    elem.text = f'{random.choice(NAMES)} {spec.key} {ctx["id"]}'
+
+
+def gen_number(elem, spec, ctx):
+    elem.text = str(random.choice((120, 150, 180.5, 200)))
+
+
+def gen_boolean(elem, spec, ctx):
+    elem.text = random.choice(('true', 'false', 'false'))
+
+
+def gen_color(elem, spec, ctx):
+    for tag in 'RGB':
+        node_at(elem, tag).text = str(random.randint(0, 255))
+
+
+def gen_level(elem, spec, ctx):
+    # 最后一个难度（Re:MASTER）一半的乐曲没有，等级为0
+    missing = ctx['index'] == 5 and random.random() < 0.5
+    node_at(elem, 'level').text = '0' if missing else str(1 + ctx['index'] * 2 + random.randint(0, 2))
+    node_at(elem, 'levelDecimal').text = str(random.randint(0, 9))
+
+
+def gen_chart(elem, spec, ctx):
+    # 谱面文件名与乐曲ID对应；等级为0的难度不生成谱面
+    name = f'{ctx["id"]:06d}_{ctx["index"]:02d}.ma2'
+    elem.text = name
+    if ctx['item'].find('level').text != '0' and ctx['notes']:
+        write_chart(os.path.join(ctx['dir'], name), random.randint(ctx['notes'] // 2, ctx['notes']))
+
+
+GENERATORS = {
+    parse.integer: gen_integer,
+    parse.text: gen_text,
+    parse.number: gen_number,
+    parse.boolean: gen_boolean,
+    parse.color: gen_color,
+    parse.level: gen_level,
+    parse.volume: gen_chart,
+    # 与volume共用同一个谱面文件
+    parse.chart: None,
+    # 由元素在列表中的位置得到
+    parse.list_index: None,
+}
+
+
+def build(elem, fields, ctx):
+    for spec in fields:
+        if isinstance(spec, Field):
+            generate = GENERATORS[spec.convert]
+            if generate is not None:
+                generate(node_at(elem, spec.path), spec, ctx)
+        elif isinstance(spec, Group):
+            build(elem, spec.fields, ctx)
+        else:
+            if spec.when:
+                # 四分之一的条目不满足条件（如随机段位isRandom为true），列表为空
+                matched = random.random() < 0.75
+                node_at(elem, spec.when[0]).text = spec.when[1] if matched else OTHER_TEXT[spec.when[1]]
+            parent_path, _, tag = spec.path.rpartition('/')
+            parent = node_at(elem, parent_path)
+            # music固定6个难度，其他列表随机1~5项
+            count = 6 if spec.key == 'note' else random.randint(1, 5)
+            for index in range(count):
+                item = et.SubElement(parent, tag)
+                build(item, spec.fields, dict(ctx, item=item, index=index))
+
+
+def generate(root, count, categories=None, notes=500, seed=0):
+    # 每个分类生成count个条目，返回生成的文件数
+    random.seed(seed)
+    files = 0
+    for dir_name, file_name, _, fields in parse.categories:
+        if categories and dir_name not in categories:
+            continue
+        for i in range(count):
+            entry_id = FIRST_ID + i
+            entry_dir = os.path.join(root, dir_name, f'{dir_name}{entry_id:06d}')
+            os.makedirs(entry_dir, exist_ok=True)
+            xml = et.Element(file_name[:-4] + 'Data')
+            build(xml, fields, {'id': entry_id, 'count': count, 'dir': entry_dir, 'notes': notes, 'index': 0})
+            et.ElementTree(xml).write(os.path.join(entry_dir, file_name), encoding='utf-8', xml_declaration=True)
+            files += 1
+    return files
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Write a synthetic OPT tree for testing and benchmarks.')
+    arg_parser.add_argument('path', help='output folder, e.g. synth/A000')
+    arg_parser.add_argument('-n', '--entries', type=int, default=100, help='entries per category (default: 100)')
+    arg_parser.add_argument('--categories', help='comma separated category folders (default: all)')
+    arg_parser.add_argument('--notes', type=int, default=500,
+                            help='maximum notes per chart, 0 writes no charts (default: 500)')
+    arg_parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    args = arg_parser.parse_args()
+
+    written = generate(args.path, args.entries, args.categories.split(',') if args.categories else None,
+                       args.notes, args.seed)
+    print(f'Wrote {written} xml files to {args.path}')
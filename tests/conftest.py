@@ -0,0 +1,6 @@
+import os.path
+import sys
+
+# 测试直接导入仓库根目录下的模块
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,43 @@
+import pytest
+
+import charts
+
+
+def write_table(path):
+    # 谱师5与3的总数相同，5先出现；谱师7的总数最多
+    table = charts.ChartTable()
+    for music_id, designer, total, density in ((100, 5, 300, 4.5), (101, 3, 200, 6.0), (102, 3, 100, 4.5),
+                                               (103, 7, 900, 6.0), (104, 5, None, None)):
+        table.add({'musicId': music_id, 'bpm': 150.0, 'note': [{
+            'difficulty': 0, 'level': 12.7, 'designerId': designer, 'volume': {'all': total},
+            'chart': {'avgDensity': density} if density is not None else None}]})
+    table.save(path)
+
+
+def load(path, use_numpy):
+    # 没有NumPy时列为memoryview，查询走纯Python的实现
+    if not use_numpy:
+        numpy, charts.numpy = charts.numpy, None
+        try:
+            return summaries(charts.load(path))
+        finally:
+            charts.numpy = numpy
+    return summaries(charts.load(path))
+
+
+def summaries(data):
+    return data.level_histogram(1.0), data.designer_totals(), data.densest(3)
+
+
+def test_fallback_ties(tmp_path):
+    write_table(tmp_path / 'charts.bin')
+    histogram, designers, densest = load(tmp_path / 'charts.bin', False)
+    assert histogram == [(12.0, 5)]
+    assert designers == [(7, 1, 900), (3, 2, 300), (5, 2, 300)]
+    assert densest == [(1, 101, 0, 6.0), (3, 103, 0, 6.0), (0, 100, 0, 4.5)]
+
+
+def test_numpy_matches_fallback(tmp_path):
+    pytest.importorskip('numpy')
+    write_table(tmp_path / 'charts.bin')
+    assert load(tmp_path / 'charts.bin', True) == load(tmp_path / 'charts.bin', False)
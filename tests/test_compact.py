@@ -0,0 +1,47 @@
+import gzip
+import json
+
+import pytest
+
+import compact
+
+# 覆盖各种kind：None、字符串、嵌套对象、各种列表（含None与混合类型）、需要转义的键
+CATEGORIES = {
+    'Music': [
+        {'musicId': 100, 'musicName': 'ベータ', 'bpm': 150.5, 'info': {'eventId': None, 'lockType': 0},
+         'note': [{'level': 12.7, 'volume': {'tap': 1, 'all': 3}, 'chart': None},
+                  {'level': 13.0, 'volume': {'tap': 2, 'all': 4}, 'chart': {'nps': [1, 2, 3]}}]},
+        {'musicId': 101, 'musicName': None, 'bpm': 180, 'info': {'eventId': 5, 'lockType': 1}, 'note': []},
+    ],
+    'Event': [
+        {'eventId': 1, 'tags': ['a', None, 'a'], 'mixed': [1, 'x', None, {'k': 'v'}, [True]],
+         'nested': [[1, 2], None, []], 'key "quoted"\n': False},
+    ],
+    'Empty': [],
+}
+
+
+@pytest.mark.parametrize('encoding', ['json', 'gzip'])
+def test_round_trip(tmp_path, encoding):
+    path = tmp_path / 'A000.compact'
+    compact.write(path, CATEGORIES, encoding)
+    loaded = compact.load(path)
+    assert loaded == CATEGORIES
+    # 键的顺序与json输出相同
+    assert json.dumps(loaded, ensure_ascii=False) == json.dumps(CATEGORIES, ensure_ascii=False)
+    assert compact.load(path, 'Music') == {'Music': CATEGORIES['Music']}
+
+
+def test_gzip_is_plain_gzip_of_the_json_encoding(tmp_path):
+    compact.write(tmp_path / 'a.json', CATEGORIES)
+    compact.write(tmp_path / 'a.json.gz', CATEGORIES, 'gzip')
+    raw = (tmp_path / 'a.json.gz').read_bytes()
+    assert gzip.decompress(raw) == (tmp_path / 'a.json').read_bytes()
+    assert len(raw) < (tmp_path / 'a.json').stat().st_size
+
+
+def test_rejects_invalid_shapes(tmp_path):
+    data = {'version': compact.COMPACT_VERSION, 'strings': [], 'shapes': [[['a'], 'x']], 'categories': {}}
+    (tmp_path / 'bad.json').write_text(json.dumps(data))
+    with pytest.raises(ValueError):
+        compact.load(tmp_path / 'bad.json')
@@ -0,0 +1,46 @@
+import glob
+import json
+import os.path
+import subprocess
+import sys
+
+import pytest
+
+import parse
+import synth_opt
+from conftest import ROOT
+
+# 合成opt的期望输出；覆盖所有分类，包括随机段位（isRandom为true，courseMusic为空）与等级为0的谱面
+# 修改字段表或synth_opt之后重新生成并检查差异：
+#   python synth_opt.py /tmp/golden/A000 -n 4 --notes 8 && (cd /tmp/golden && python $OLDPWD/parse.py A000/)
+#   cp /tmp/golden/A000-*.json tests/golden/
+GOLDEN = os.path.join(os.path.dirname(__file__), 'golden')
+
+
+def extract(tmp_path, *args):
+    synth_opt.generate(str(tmp_path / 'A000'), 4, notes=8)
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'parse.py'), 'A000/', *args], cwd=tmp_path,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return sorted(glob.glob(str(tmp_path / 'A000-*.json')))
+
+
+def test_golden_covers_every_case():
+    assert sorted(os.listdir(GOLDEN)) == sorted(f'A000-{json_name}.json' for _, _, json_name, _ in parse.categories)
+    with open(os.path.join(GOLDEN, 'A000-Course.json'), encoding='utf-8') as f:
+        courses = json.load(f)
+    assert any(not dic['courseMusic'] for dic in courses) and any(dic['courseMusic'] for dic in courses)
+    with open(os.path.join(GOLDEN, 'A000-Music.json'), encoding='utf-8') as f:
+        music = json.load(f)
+    assert any(len(dic['note']) < 6 for dic in music) and any(len(dic['note']) == 6 for dic in music)
+
+
+@pytest.mark.parametrize('args', [(), ('-j', '2')])
+def test_golden_output(tmp_path, args):
+    outputs = extract(tmp_path, *args)
+    assert [os.path.basename(path) for path in outputs] == sorted(os.listdir(GOLDEN))
+    for path in outputs:
+        with open(path, encoding='utf-8') as f, open(os.path.join(GOLDEN, os.path.basename(path)),
+                                                     encoding='utf-8') as golden:
+            assert f.read() == golden.read(), os.path.basename(path)
+
@@ -0,0 +1,88 @@
+import json
+import os.path
+import sqlite3
+import subprocess
+import sys
+import xml.etree.ElementTree as et
+
+import charts
+import synth_opt
+from conftest import ROOT
+
+
+def run_parse(cwd, *args):
+    # 死锁时由timeout中断，而不是让测试一直挂起
+    return subprocess.run([sys.executable, os.path.join(ROOT, 'parse.py'), *args], cwd=cwd, capture_output=True,
+                          text=True, timeout=60)
+
+
+def dump(path):
+    with sqlite3.connect(path) as db:
+        return list(db.iterdump())
+
+
+def test_sqlite_with_max_memory(tmp_path):
+    # 等待写入锁的分类不能占住内存额度，否则持有锁的分类取不到下一块的额度
+    synth_opt.generate(str(tmp_path / 'A000'), 300, notes=20)
+    limited = tmp_path / 'limited'
+    full = tmp_path / 'full'
+    limited.mkdir()
+    full.mkdir()
+    result = run_parse(limited, '../A000/', '-j', '2', '--max-memory', '1', '--format', 'sqlite')
+    assert result.returncode == 0, result.stderr
+    result = run_parse(full, '../A000/', '-j', '2', '--format', 'sqlite')
+    assert result.returncode == 0, result.stderr
+    assert dump(limited / 'A000.db') == dump(full / 'A000.db')
+
+
+def test_merge_with_quarantined_file(tmp_path):
+    # A000中出错的文件被略去后，后面的条目仍然对应到自己所在的opt
+    for name in ('A000', 'A001'):
+        synth_opt.generate(str(tmp_path / name), 5, ['chara'])
+    with open(tmp_path / 'A000' / 'chara' / 'chara000100' / 'Chara.xml', 'w', encoding='utf-8') as f:
+        f.write('<CharaData>')
+    result = run_parse(tmp_path, 'A000/', 'A001/', '--merge', 'M', '--journal', 'journal.log')
+    assert result.returncode == 0, result.stderr
+    with open(tmp_path / 'M-Chara.json', encoding='utf-8') as f:
+        charas = json.load(f)
+    assert [(dic['charaId'], dic['opt'], dic['overrides']) for dic in charas] == \
+        [(chara_id, 'A001', ['A000']) for chara_id in range(101, 105)] + [(100, 'A001', [])]
+
+
+def test_charts_with_fields(tmp_path):
+    # --fields没有选择谱面表用到的字段时仍然提取；难度为<Notes>的原始位置，前面的谱面等级为0时不前移
+    synth_opt.generate(str(tmp_path / 'A000'), 5, ['music'], notes=20)
+    xml = tmp_path / 'A000' / 'music' / 'music000100' / 'Music.xml'
+    tree = et.parse(xml)
+    tree.find('notesData/Notes/level').text = '0'
+    tree.write(xml, encoding='utf-8', xml_declaration=True)
+    expected = []
+    for music_id in range(100, 105):
+        root = et.parse(tmp_path / 'A000' / 'music' / f'music{music_id:06d}' / 'Music.xml').getroot()
+        for difficulty, notes in enumerate(root.iterfind('notesData/Notes')):
+            if notes.find('level').text != '0':
+                expected.append((music_id, difficulty, int(notes.find('notesDesigner/id').text)))
+    result = run_parse(tmp_path, 'A000/', '--fields', 'music.musicName', '--charts', 'charts.bin')
+    assert result.returncode == 0, result.stderr
+    # 与--xref一样，强制提取的字段也会输出，但只为谱面表提取的difficulty不会
+    with open(tmp_path / 'A000-Music.json', encoding='utf-8') as f:
+        music = json.load(f)
+    assert [list(dic) for dic in music] == [['musicId', 'musicName', 'bpm', 'note']] * 5
+    assert all(list(note) == ['level', 'designerId', 'volume'] for dic in music for note in dic['note'])
+    data = charts.load(tmp_path / 'charts.bin')
+    assert [(int(data['musicId'][row]), int(data['difficulty'][row]), int(data['designerId'][row]))
+            for row in range(len(data))] == expected
+    assert all(data['all'][row] > 0 for row in range(len(data)))
+
+
+def test_cache_with_io_concurrency(tmp_path):
+    # 缓存用到的stat在线程池中完成时，第二次运行全部取自缓存，输出不变
+    synth_opt.generate(str(tmp_path / 'A000'), 20, ['music', 'chara'], notes=10)
+    outputs = []
+    for _ in range(2):
+        result = run_parse(tmp_path, 'A000/', '--cache', 'cache.json', '--io-concurrency', '4')
+        assert result.returncode == 0, result.stderr
+        with open(tmp_path / 'A000-Music.json', encoding='utf-8') as f:
+            outputs.append(f.read())
+    assert 'Reused 40 cached entries.' in result.stdout
+    assert outputs[0] == outputs[1]
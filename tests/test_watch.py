@@ -0,0 +1,40 @@
+import os
+import shutil
+
+import parse
+import synth_opt
+from watch import TreeIndex
+
+
+def summary(index):
+    # stat_result还包含访问时间，只比较扫描关心的部分
+    return {dir_name: [(entry.path, entry.xml, entry.files, entry.opt, entry.stat.st_size, entry.stat.st_mtime_ns)
+                       for entry in entries] for dir_name, entries in index.items()}
+
+
+def test_incremental_scan_matches_full_scan(tmp_path):
+    root = str(tmp_path / 'A000')
+    synth_opt.generate(root, 5, ['music', 'chara'], notes=10)
+    tree = TreeIndex(parse.default_skip)
+    assert summary(tree.scan([root], False)) == summary(parse.scan_opt(root))
+
+    # 新增、删除条目，修改已有的xml与谱面，新增谱面文件
+    shutil.copytree(os.path.join(root, 'chara', 'chara000100'), os.path.join(root, 'chara', 'chara000099'))
+    shutil.rmtree(os.path.join(root, 'chara', 'chara000102'))
+    with open(os.path.join(root, 'music', 'music000101', 'Music.xml'), 'a', encoding='utf-8') as f:
+        f.write('\n')
+    with open(os.path.join(root, 'music', 'music000103', '000103_00.ma2'), 'a', encoding='utf-8') as f:
+        f.write('\n')
+    synth_opt.write_chart(os.path.join(root, 'music', 'music000104', 'extra.ma2'), 10)
+    assert summary(tree.scan([root], False)) == summary(parse.scan_opt(root))
+    assert os.path.join(root, 'chara', 'chara000102') not in tree.dirs
+
+
+def test_incremental_scan_of_layers(tmp_path):
+    roots = [str(tmp_path / name) for name in ('B000', 'A000')]
+    for root in roots:
+        synth_opt.generate(root, 3, ['chara'])
+    tree = TreeIndex(parse.default_skip)
+    assert summary(tree.scan(roots, True)) == summary(parse.scan_layers(roots))
+    shutil.rmtree(os.path.join(roots[1], 'chara', 'chara000101'))
+    assert summary(tree.scan(roots, True)) == summary(parse.scan_layers(roots))
@@ -0,0 +1,247 @@
+# --watch：首次完整提取后轮询opt目录，只重新解析变化的条目，并更新受影响分类的输出
+# Watch mode: a full extraction first, then the OPT tree is polled by mtime. Only changed entry directories
+# are parsed again and only the affected category outputs are rewritten.
+import asyncio
+import fnmatch
+import os
+import time
+
+import compact
+import parse
+
+
+def entry_signature(entry):
+    # 条目依赖的各个文件的(路径, 大小, 修改时间)；xml的stat来自扫描，谱面文件在这里stat
+    try:
+        return tuple((path, st.st_size, st.st_mtime_ns) for path, st in parse.entry_deps(entry))
+    except FileNotFoundError:
+        # 扫描之后文件又被删除，下一次轮询时再处理
+        return None
+
+
+class TreeIndex:
+    # 增量扫描：记住每个目录的修改时间与列出的内容，轮询时只重新列出修改时间变化的目录
+    # 目录中增删文件或子目录时目录的修改时间才会变化；已知的xml在这里重新stat，谱面文件由entry_signature stat
+    def __init__(self, skip):
+        self.skip = skip
+        # 目录路径 -> (修改时间, xml路径或None, 其他文件名, 子目录路径)；压缩包路径 -> ((大小, 修改时间), 索引)
+        self.dirs = {}
+        self.archives = {}
+
+    def listdir(self, path, file_name, seen):
+        mtime = os.stat(path).st_mtime_ns
+        record = self.dirs.get(path)
+        if record is None or record[0] != mtime:
+            # 与parse.scan_category相同的过滤与排序
+            xml = None
+            dirs = []
+            files = []
+            with os.scandir(path) as it:
+                for item in it:
+                    if any(fnmatch.fnmatchcase(item.name, pattern) for pattern in self.skip):
+                        continue
+                    if item.is_dir(follow_symlinks=False):
+                        dirs.append(item)
+                    elif item.name == file_name:
+                        xml = item.path
+                    else:
+                        files.append(item.name)
+            record = (mtime, xml, tuple(sorted(files)), [item.path for item in sorted(dirs, key=lambda d: d.name)])
+        seen[path] = record
+        return record
+
+    def scan_category(self, path, file_name, entries, seen):
+        try:
+            _, xml, files, dirs = self.listdir(path, file_name, seen)
+            if xml is not None:
+                entries.append(parse.Entry(path, xml, os.stat(xml), files))
+        except FileNotFoundError:
+            # 列出之后又被删除，上一级目录的修改时间随之变化，下一次轮询时重新列出
+            return
+        for sub in dirs:
+            self.scan_category(sub, file_name, entries, seen)
+
+    def scan_opt(self, root, seen, seen_archives):
+        if parse.is_archive(root):
+            # 压缩包只比较大小与修改时间，有变化时整个重新扫描
+            st = os.stat(root)
+            record = self.archives.get(root)
+            if record is None or record[0] != (st.st_size, st.st_mtime_ns):
+                record = ((st.st_size, st.st_mtime_ns), parse.scan_opt(root, self.skip))
+            seen_archives[root] = record
+            return record[1]
+        file_names = {dir_name: file_name for dir_name, file_name, _, _ in parse.categories}
+        index = {}
+        with os.scandir(root) as it:
+            dirs = [(item.name, item.path) for item in it if item.name in file_names and item.is_dir()]
+        for dir_name, path in dirs:
+            self.scan_category(path, file_names[dir_name], index.setdefault(dir_name, []), seen)
+        return index
+
+    def scan(self, roots, merge):
+        # 与parse.scan_opt/scan_layers得到相同的索引；这次没有经过的目录从记录中去掉
+        seen = {}
+        seen_archives = {}
+        if not merge:
+            index = self.scan_opt(roots[0], seen, seen_archives)
+        else:
+            index = {}
+            for root in sorted(roots, key=parse.opt_name_of):
+                opt = parse.opt_name_of(root)
+                for dir_name, entries in self.scan_opt(root, seen, seen_archives).items():
+                    index.setdefault(dir_name, []).extend(entry._replace(opt=opt) for entry in entries)
+        self.dirs = seen
+        self.archives = seen_archives
+        return index
+
+
+async def iter_list(items):
+    for item in items:
+        yield item
+
+
+class Watcher:
+    def __init__(self, roots, opt_name, parsers, jobs=1, output_format='json', skip=parse.default_skip, merge=False,
+                 interval=0.5):
+        self.roots = roots
+        self.opt_name = opt_name
+        # 分类目录名 -> (输出名, 提取函数)
+        self.parsers = parsers
+        self.jobs = jobs
+        self.output_format = output_format
+        self.skip = skip
+        self.merge = merge
+        self.interval = interval
+        # 输出名 -> 该分类的条目列表、各条目的签名、字典以及序列化后的文本
+        self.entries = {}
+        self.signatures = {}
+        self.dics = {}
+        self.texts = {}
+        self.database = None
+        self.tree = TreeIndex(skip)
+
+    def scan(self):
+        return self.tree.scan(self.roots, self.merge)
+
+    def parse_entries(self, json_name, parser, entries):
+        # 变化的条目较多时交给进程池；任何一个失败时改为逐个解析，出错的条目保留原来的结果
+        if self.jobs > 1 and len(entries) >= 64:
+            pipeline = parse.Pipeline(self.opt_name, self.jobs, None, None)
+            try:
+                asyncio.run(pipeline.run([(entries, json_name, parser)]))
+                return dict(zip((entry.xml for entry in entries), pipeline.results[json_name]))
+            except Exception:
+                pass
+        dics = {}
+        for entry in entries:
+            try:
+                dics[entry.xml] = parser(entry.xml)
+            except Exception as error:
+                print(f'Failed to parse {entry.xml}: {error!r}')
+        return dics
+
+    def output(self, json_name, parser):
+        entries = self.entries[json_name]
+        dics = self.dics[json_name]
+        if self.merge:
+            return parse.merge_dics([(entry.opt, dics[entry.xml]) for entry in entries if entry.xml in dics],
+                                    parser.fields[0].key)
+        return [dics[entry.xml] for entry in entries if entry.xml in dics]
+
+    def write_compact(self):
+        # 紧凑格式的所有分类共用一个字符串表，有分类更新时整个文件重新写出
+        writer = parse.open_writer(self.opt_name, self.output_format)
+        path = writer.path
+        for json_name, parser in self.parsers.values():
+            if json_name in self.entries:
+                writer.categories[json_name] = [writer.encoder.encode_dict(dic)
+                                                for dic in self.output(json_name, parser)]
+        writer.path += '.tmp'
+        writer.close()
+        os.replace(writer.path, path)
+
+    def write(self, json_name, parser):
+        entries = self.entries[json_name]
+        dics = self.dics[json_name]
+        output = self.output(json_name, parser)
+        if self.database is not None:
+            fields, select = parser.fields, parser.select
+            if self.merge:
+                fields = fields + parse.layer_fields
+                select = select and dict(select, **{spec.key: None for spec in parse.layer_fields})
+            asyncio.run(self.database.save(json_name, fields, select, iter_list(output)))
+            return
+        if self.merge:
+            # 合并后的条目取决于所有层，整体重新序列化
+            texts = [parse.format_entry(dic, self.output_format) for dic in output]
+        else:
+            # 只有变化过的条目需要重新序列化
+            cache = self.texts.setdefault(json_name, {})
+            texts = []
+            for entry in entries:
+                if entry.xml in dics:
+                    if entry.xml not in cache:
+                        cache[entry.xml] = parse.format_entry(dics[entry.xml], self.output_format)
+                    texts.append(cache[entry.xml])
+        # 先写入临时文件再替换，读取输出的程序不会看到写了一半的文件
+        file_name = f'{self.opt_name}-{json_name}.{self.output_format}'
+        with open(file_name + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(parse.join_entries(texts, self.output_format))
+        os.replace(file_name + '.tmp', file_name)
+
+    def update(self, index, first=False):
+        # 对比这次扫描的结果，返回有更新的分类及其变化的条目数
+        updated = []
+        for dir_name, (json_name, parser) in self.parsers.items():
+            entries = index.get(dir_name, [])
+            if json_name not in self.entries and not entries:
+                continue
+            old = self.signatures.get(json_name, {})
+            signatures = {entry.xml: entry_signature(entry) for entry in entries}
+            changed = [entry for entry in entries if entry.xml not in old or old[entry.xml] != signatures[entry.xml]]
+            removed = [xml for xml in old if xml not in signatures]
+            order_changed = [entry.xml for entry in self.entries.get(json_name, [])] != list(signatures)
+            if not first and not changed and not removed and not order_changed:
+                continue
+            dics = self.dics.setdefault(json_name, {})
+            cache = self.texts.setdefault(json_name, {})
+            for xml in removed:
+                dics.pop(xml, None)
+                cache.pop(xml, None)
+            for xml, dic in self.parse_entries(json_name, parser, changed).items():
+                dics[xml] = dic
+                cache.pop(xml, None)
+            self.entries[json_name] = entries
+            self.signatures[json_name] = signatures
+            if self.output_format not in compact.EXTENSIONS:
+                self.write(json_name, parser)
+            updated.append((json_name, len(changed), len(removed)))
+        if updated and self.output_format in compact.EXTENSIONS:
+            self.write_compact()
+        return updated
+
+    def run(self):
+        if self.output_format == 'sqlite':
+            self.database = parse.open_writer(self.opt_name, self.output_format)
+        try:
+            start = time.perf_counter()
+            self.update(self.scan(), True)
+            print(f'Initial build done in {time.perf_counter() - start:.3f} s')
+            print(f'Watching {", ".join(self.roots)} for changes every {self.interval} s, press Ctrl+C to stop.')
+            while True:
+                time.sleep(self.interval)
+                start = time.perf_counter()
+                try:
+                    index = self.scan()
+                except (FileNotFoundError, ValueError) as error:
+                    # 目录或压缩包正在被替换
+                    print(f'Scan failed: {error}')
+                    continue
+                for json_name, changed, removed in self.update(index):
+                    print(f'Updated {json_name}: {changed} changed, {removed} removed '
+                          f'in {time.perf_counter() - start:.3f} s')
+        except KeyboardInterrupt:
+            print('Stopped watching.')
+        finally:
+            if self.database is not None:
+                self.database.close()
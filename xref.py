@@ -0,0 +1,143 @@
+# 跨分类的ID索引：各分类的ID哈希索引、反向引用（如某首乐曲被哪些地图、段位、挑战、登录奖励引用）以及悬空引用
+# Cross-reference index over the extracted categories: ID lookups, reverse references and dangling references.
+# Built while the outputs are written, saved as a precomputed index file, and queryable in-process.
+import json
+
+# 引用表: 分类, 字段路径（用点连接，列表中的每个元素都会查找）, 被引用的分类
+# 只列出被引用分类也会被提取的外键；值为None或不大于0时表示没有引用
+REFERENCES = [
+    ('Challenge', 'music.musicId', 'Music'),
+    ('Challenge', 'event.eventId', 'Event'),
+    ('Chara', 'genreId', 'CharaGenre'),
+    ('Course', 'baseDaniId', 'Course'),
+    ('Course', 'baseCourseId', 'Course'),
+    ('Course', 'eventId', 'Event'),
+    ('Course', 'courseMusic.musicId', 'Music'),
+    ('Frame', 'frameInfo.eventId', 'Event'),
+    ('Frame', 'frameInfo.collectionGenre', 'CollectionGenre'),
+    ('Icon', 'iconInfo.eventId', 'Event'),
+    ('Icon', 'iconInfo.collectionGenre', 'CollectionGenre'),
+    ('LoginBonus', 'eventId', 'Event'),
+    ('LoginBonus', 'bonusValue.characterId', 'Chara'),
+    ('LoginBonus', 'bonusValue.musicId', 'Music'),
+    ('LoginBonus', 'bonusValue.iconId', 'Icon'),
+    ('LoginBonus', 'bonusValue.frameId', 'Frame'),
+    ('Map', 'colorId', 'MapColor'),
+    ('Map', 'bonusMusicId', 'MapBonusMusic'),
+    ('Map', 'eventId', 'Event'),
+    ('Map', 'mapDetail.treasureId', 'MapTreasure'),
+    ('MapBonusMusic', 'musicList.musicId', 'Music'),
+    ('MapTreasure', 'treasureDetail.characterId', 'Chara'),
+    ('MapTreasure', 'treasureDetail.musicId', 'Music'),
+    ('MapTreasure', 'treasureDetail.frameId', 'Frame'),
+    ('MapTreasure', 'treasureDetail.iconId', 'Icon'),
+    ('MapTreasure', 'treasureDetail.challengeId', 'Challenge'),
+    ('Music', 'info.eventId', 'Event'),
+]
+INDEX_VERSION = 1
+
+
+def field_values(value, keys):
+    # 按字段路径取出所有的值，遇到列表时对每个元素继续查找
+    if isinstance(value, list):
+        for item in value:
+            yield from field_values(item, keys)
+    elif not keys:
+        yield value
+    elif isinstance(value, dict):
+        yield from field_values(value.get(keys[0]), keys[1:])
+
+
+def is_reference(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+class CrossIndex:
+    # keep为True时保存各条目的字典，get可以直接取出条目；否则只记录ID
+    def __init__(self, keep=False):
+        self.keep = keep
+        # 分类 -> {ID: 字典或None}
+        self.ids = {}
+        # 分类 -> {ID: [(字段, 被引用的分类, 被引用的ID)]}
+        self.refs = {}
+        # 被引用的分类 -> {被引用的ID: [(分类, ID, 字段)]}
+        self.referenced_by = {}
+        self.dangling = []
+        self.rules = {}
+        for category, path, target in REFERENCES:
+            self.rules.setdefault(category, []).append((path, path.split('.'), target))
+
+    def add(self, category, entry_id, dic):
+        self.ids.setdefault(category, {})[entry_id] = dic if self.keep else None
+        refs = []
+        for path, keys, target in self.rules.get(category, ()):
+            for value in field_values(dic, keys):
+                if is_reference(value):
+                    refs.append((path, target, value))
+        if refs:
+            self.refs.setdefault(category, {})[entry_id] = refs
+
+    async def tap(self, category, id_key, dics):
+        # 接在输出之前，条目经过时记录ID和引用，不改变输出
+        async for dic in dics:
+            self.add(category, dic.get(id_key), dic)
+            yield dic
+
+    def resolve(self):
+        # 全部条目加入后建立反向引用；被引用的分类也被提取了但找不到对应ID时记为悬空引用
+        self.referenced_by = {}
+        self.dangling = []
+        for category, refs in self.refs.items():
+            for entry_id, items in refs.items():
+                for path, target, value in items:
+                    self.referenced_by.setdefault(target, {}).setdefault(value, []).append((category, entry_id, path))
+                    if target in self.ids and value not in self.ids[target]:
+                        self.dangling.append({'category': category, 'id': entry_id, 'field': path,
+                                              'target': target, 'targetId': value})
+        return self
+
+    def get(self, category, entry_id):
+        return self.ids.get(category, {}).get(entry_id)
+
+    def __contains__(self, key):
+        category, entry_id = key
+        return entry_id in self.ids.get(category, {})
+
+    def referrers(self, category, entry_id, source=None):
+        # 引用了该条目的(分类, ID, 字段)，source限定引用方的分类
+        return [ref for ref in self.referenced_by.get(category, {}).get(entry_id, ())
+                if source is None or ref[0] == source]
+
+    def references(self, category, entry_id):
+        # 该条目引用的(字段, 分类, ID)
+        return list(self.refs.get(category, {}).get(entry_id, ()))
+
+    def save(self, path):
+        # 索引文件：各分类的ID、正向与反向引用、悬空引用；JSON的键只能是字符串，ID写成字符串
+        data = {
+            'version': INDEX_VERSION,
+            'ids': {category: list(ids) for category, ids in self.ids.items()},
+            'references': {category: {str(entry_id): items for entry_id, items in refs.items()}
+                           for category, refs in self.refs.items()},
+            'referencedBy': {category: {str(entry_id): items for entry_id, items in refs.items()}
+                             for category, refs in self.referenced_by.items()},
+            'dangling': self.dangling,
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError(f'{path} was written by a different version of the index')
+        index = cls()
+        index.ids = {category: dict.fromkeys(ids) for category, ids in data['ids'].items()}
+        index.refs = {category: {int(entry_id): [tuple(item) for item in items] for entry_id, items in refs.items()}
+                      for category, refs in data['references'].items()}
+        index.referenced_by = {category: {int(entry_id): [tuple(item) for item in items]
+                                          for entry_id, items in refs.items()}
+                               for category, refs in data['referencedBy'].items()}
+        index.dangling = data['dangling']
+        return index